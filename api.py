@@ -1,7 +1,39 @@
+import asyncio
+import time
 import aiohttp
-from pydantic import BaseModel, Field
+import codec
+import metrics
+from pydantic import BaseModel, ConfigDict, Field
+from balance import ExpenseEvent, ExpenseSnapshot, Ledger, Share, to_cents
+from cache import CacheStats, TTLCache
+from concurrency import SingleFlight, SingleFlightStats
+from deadline import Deadline, DeadlineExceeded
 from env import env
-from typing import Optional, Union
+from http_pool import PoolMonitor, PoolStats, build_connector, build_timeout
+from resilience import (
+    BreakerConfig,
+    CircuitOpenError,
+    EndpointStats,
+    Resilience,
+    RetryPolicy,
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
+
+T = TypeVar("T")
+
+# * Request functions take the timeout for their HTTP call, derived per attempt
+RequestFn = Callable[[aiohttp.ClientTimeout], Awaitable[T]]
 
 
 class User(BaseModel):
@@ -45,7 +77,12 @@ class CreateUserPayload(BaseModel):
 
 
 class CreateUserResult(ApiResult):
-    pass
+    # * The backend already had the user
+    existed: bool = Field(default=False)
+
+
+class ExportUserIdsResult(ApiResult):
+    user_ids: List[int]
 
 
 class AddMemberPayload(BaseModel):
@@ -60,33 +97,341 @@ class AddMemberResult(ApiResult):
     pass
 
 
+class MemberPayload(BaseModel):
+    user_id: int
+    first_name: str
+    last_name: Optional[str] = Field(default=None)
+    username: Optional[str] = Field(default=None)
+
+
+class AddMembersBulkPayload(BaseModel):
+    chat_id: int
+    members: List[MemberPayload]
+
+
+class GetLedgerPayload(BaseModel):
+    chat_id: int
+
+
+class GetLedgerResult(ApiResult):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    members: List[User]
+    ledger: Ledger
+    # * Ledger version, the base for applying later expense events
+    version: int = Field(default=0)
+
+
+class GetExpenseEventsPayload(BaseModel):
+    chat_id: int
+    since_version: int
+
+
+class GetExpenseEventsResult(ApiResult):
+    events: List[ExpenseEvent]
+    members: List[User] = Field(default_factory=list)
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+async def read_json(response: aiohttp.ClientResponse) -> Any:
+    return codec.loads(await response.read())
+
+
+async def read_json_or_none(response: aiohttp.ClientResponse) -> Any:
+    """Decoded body, None when it is not JSON"""
+    try:
+        return await read_json(response)
+    # * Each codec raises its own decode error
+    except Exception:
+        return None
+
+
+def user_from_data(userData: Dict[str, Any]) -> User:
+    return User(
+        id=userData.get("id"),
+        first_name=userData.get("firstName"),
+        last_name=userData.get("lastName"),
+        username=userData.get("username"),
+        created_at=userData.get("createdAt"),
+        updated_at=userData.get("updatedAt"),
+    )
+
+
+def expense_from_data(expenseData: Dict[str, Any]) -> ExpenseSnapshot:
+    # * The backend sends amounts in dollars
+    return ExpenseSnapshot(
+        payer_id=expenseData["payerId"],
+        amount=round(expenseData["amount"] * 100),
+        shares=[
+            Share(user_id=share["userId"], amount=round(share["amount"] * 100))
+            for share in expenseData.get("shares") or []
+        ],
+    )
+
+
+def expense_event_from_data(eventData: Dict[str, Any]) -> ExpenseEvent:
+    expense = eventData.get("expense")
+    previous = eventData.get("previous")
+    return ExpenseEvent(
+        version=eventData["version"],
+        kind=eventData["type"],
+        expense=expense_from_data(expense) if expense else None,
+        previous=expense_from_data(previous) if previous else None,
+    )
+
+
+def user_ids_from_body(body: bytes, status: int) -> ExportUserIdsResult:
+    res = codec.loads(body)
+    return ExportUserIdsResult(
+        user_ids=res.get("data") or [],
+        status=status,
+        message=res.get("message"),
+    )
+
+
+def result_status(result: Any) -> str:
+    """Status label of an Api call outcome"""
+    if isinstance(result, (ApiResult, ApiError)):
+        return str(result.status)
+    if isinstance(result, DeadlineExceeded):
+        return "deadline_exceeded"
+    if isinstance(result, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(result, Exception):
+        return type(result).__name__
+    return "ok"
+
+
+# * Statuses meaning the backend does not support the bulk members endpoint
+BULK_UNSUPPORTED_STATUSES = (404, 405, 501)
+
+# * Status of creating a user the backend already has, /start also copes without it
+USER_EXISTS_STATUS = 409
+
+
 class Api:
     def __init__(self):
         self.default_headers = {"Authorization": f"Bearer {env.API_KEY}"}
-        self.aio_session = aiohttp.ClientSession(
-            base_url=env.API_BASE_URL,
-            headers=self.default_headers,
+        # * The session is created on first use, keeping it off the startup path
+        self._aio_session: Optional[aiohttp.ClientSession] = None
+        self._pool_monitor: Optional[PoolMonitor] = None
+        # * Cache of get_user results keyed by user_id, 404s are cached with a shorter ttl
+        self.user_cache: TTLCache[int, GetUserResult] = TTLCache(
+            max_size=env.API_USER_CACHE_MAX_SIZE,
+            ttl=env.API_USER_CACHE_TTL,
+        )
+        # * Concurrent identical calls share a single in-flight request
+        self.single_flight: SingleFlight = SingleFlight()
+        # * Deadline of each call in flight, the latest of the callers sharing it
+        self._flight_deadlines: Dict[Tuple[str, str], Deadline] = {}
+        # * Monotonic time until which the bulk members endpoint is not tried, set
+        # * when the backend rejects it and probed again once it has passed
+        self.bulk_add_members_unsupported_until = 0.0
+        # * Retries and per-endpoint circuit breakers shared by all calls
+        self.resilience = Resilience(
+            retry_policy=RetryPolicy(
+                max_attempts=env.API_RETRY_MAX_ATTEMPTS,
+                base_delay=env.API_RETRY_BASE_DELAY,
+                max_delay=env.API_RETRY_MAX_DELAY,
+            ),
+            breaker_config=BreakerConfig(
+                failure_threshold=env.API_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=env.API_BREAKER_RESET_TIMEOUT,
+                half_open_probes=env.API_BREAKER_HALF_OPEN_PROBES,
+            ),
+        )
+
+    @property
+    def aio_session(self) -> aiohttp.ClientSession:
+        return self._open_session()
+
+    @property
+    def pool_monitor(self) -> PoolMonitor:
+        self._open_session()
+        return cast(PoolMonitor, self._pool_monitor)
+
+    def _open_session(self) -> aiohttp.ClientSession:
+        if self._aio_session is None:
+            self._pool_monitor = PoolMonitor(build_connector())
+            self._aio_session = aiohttp.ClientSession(
+                base_url=env.API_BASE_URL,
+                headers=self.default_headers,
+                json_serialize=codec.dumps,
+                connector=self._pool_monitor.connector,
+                timeout=build_timeout(),
+                trace_configs=[self._pool_monitor.trace_config],
+            )
+        return self._aio_session
+
+    def user_cache_stats(self) -> CacheStats:
+        return self.user_cache.stats()
+
+    def single_flight_stats(self) -> SingleFlightStats:
+        return self.single_flight.stats()
+
+    def pool_stats(self) -> PoolStats:
+        return self.pool_monitor.stats()
+
+    def resilience_stats(self) -> Dict[str, EndpointStats]:
+        return self.resilience.stats()
+
+    def _timeout(self, deadline: Optional[Deadline]) -> aiohttp.ClientTimeout:
+        """HTTP timeout for the next attempt, capped by the time left on the deadline"""
+        if deadline is None:
+            return self.aio_session.timeout
+
+        return aiohttp.ClientTimeout(
+            total=min(env.API_TOTAL_TIMEOUT, deadline.remaining()),
+            connect=env.API_CONNECT_TIMEOUT,
         )
 
+    async def _call(
+        self,
+        endpoint: str,
+        fn: RequestFn[T],
+        idempotent: bool,
+        deadline: Optional[Deadline] = None,
+    ) -> Union[T, Exception]:
+        started = time.perf_counter() if metrics.enabled else 0.0
+        result: Union[T, Exception]
+        try:
+            result = await self.resilience.call(
+                endpoint,
+                lambda: fn(self._timeout(deadline)),
+                idempotent=idempotent,
+                deadline=deadline,
+            )
+        except Exception as e:
+            if deadline is not None and deadline.expired():
+                result = DeadlineExceeded(endpoint)
+            else:
+                result = e
+
+        if metrics.enabled:
+            metrics.API_LATENCY.observe(
+                time.perf_counter() - started, endpoint, result_status(result)
+            )
+        return result
+
+    async def _within(
+        self,
+        endpoint: str,
+        deadline: Optional[Deadline],
+        call: Awaitable[Union[T, Exception]],
+    ) -> Union[T, Exception]:
+        """Stop waiting on `call` once the deadline runs out"""
+        if deadline is None:
+            return await call
+
+        try:
+            return await asyncio.wait_for(call, timeout=deadline.remaining())
+        except asyncio.TimeoutError:
+            return DeadlineExceeded(endpoint)
+
+    async def _request(
+        self,
+        endpoint: str,
+        payload: BaseModel,
+        fn: RequestFn[T],
+        idempotent: bool,
+        coalesce: bool = False,
+        deadline: Optional[Deadline] = None,
+    ) -> Union[T, Exception]:
+        if coalesce:
+            call = self._coalesce(
+                endpoint,
+                payload,
+                lambda shared: self._call(endpoint, fn, idempotent, shared),
+                deadline,
+            )
+        else:
+            call = self._call(endpoint, fn, idempotent, deadline)
+        return await self._within(endpoint, deadline, call)
+
+    async def _coalesce(
+        self,
+        method: str,
+        payload: BaseModel,
+        fn: Callable[[Deadline], Awaitable[T]],
+        deadline: Optional[Deadline],
+    ) -> T:
+        """Share one call among concurrent identical calls.
+
+        The shared call runs until the latest deadline of the callers joining it,
+        so a caller with time left is not failed by an earlier caller's deadline.
+        Each caller stops waiting at its own deadline through `_within`.
+        """
+        key = (method, payload.model_dump_json())
+        shared = self._flight_deadlines.get(key)
+        if shared is not None:
+            shared.extend(deadline)
+            return await self.single_flight.do(key, lambda: fn(cast(Deadline, shared)))
+
+        shared = Deadline(0)
+        shared.extend(deadline)
+        self._flight_deadlines[key] = shared
+
+        async def run() -> T:
+            try:
+                return await fn(cast(Deadline, shared))
+            finally:
+                if self._flight_deadlines.get(key) is shared:
+                    del self._flight_deadlines[key]
+
+        return await self.single_flight.do(key, run)
+
     async def get_user(
-        self, payload: GetUserPayload
+        self, payload: GetUserPayload, deadline: Optional[Deadline] = None
+    ) -> Union[GetUserResult, Exception]:
+        cached = self.user_cache.get(payload.user_id)
+        if cached is not None:
+            return cached
+
+        return await self._within(
+            "get_user",
+            deadline,
+            self._coalesce(
+                "get_user",
+                payload,
+                lambda shared: self._load_user(payload, shared),
+                deadline,
+            ),
+        )
+
+    async def _load_user(
+        self, payload: GetUserPayload, deadline: Optional[Deadline]
     ) -> Union[GetUserResult, Exception]:
+        result = await self._call(
+            "get_user",
+            lambda timeout: self._fetch_user(payload, timeout),
+            idempotent=True,
+            deadline=deadline,
+        )
+        if isinstance(result, GetUserResult):
+            ttl = env.API_USER_CACHE_NEGATIVE_TTL if result.user is None else None
+            self.user_cache.set(payload.user_id, result, ttl=ttl)
+        return result
+
+    async def _fetch_user(
+        self, payload: GetUserPayload, timeout: aiohttp.ClientTimeout
+    ) -> GetUserResult:
         try:
-            async with self.aio_session.get(f"user/{payload.user_id}") as response:
+            async with self.aio_session.get(
+                f"user/{payload.user_id}", timeout=timeout
+            ) as response:
                 response.raise_for_status()
 
-                data = await response.json()
+                data = await read_json(response)
                 userData = data.get("data")
 
                 return GetUserResult(
-                    user=User(
-                        id=userData.get("id"),
-                        first_name=userData.get("firstName"),
-                        last_name=userData.get("lastName"),
-                        username=userData.get("username"),
-                        created_at=userData.get("createdAt"),
-                        updated_at=userData.get("updatedAt"),
-                    ),
+                    user=user_from_data(userData),
                     status=response.status,
                     message=data.get("message"),
                 )
@@ -97,69 +442,292 @@ class Api:
                     status=e.status,
                     message="User not found",
                 )
-            return e
-        except Exception as e:
-            return e
+            raise
 
     async def create_user(
-        self, payload: CreateUserPayload
+        self,
+        payload: CreateUserPayload,
+        coalesce: bool = False,
+        deadline: Optional[Deadline] = None,
     ) -> Union[CreateUserResult, Exception]:
-        try:
-            async with self.aio_session.post(
-                "user",
-                json=payload.model_dump(),
-            ) as response:
-                response.raise_for_status()
-
-                data = await response.json()
+        return await self._request(
+            "create_user",
+            payload,
+            lambda timeout: self._create_user(payload, timeout),
+            idempotent=False,
+            coalesce=coalesce,
+            deadline=deadline,
+        )
 
+    async def _create_user(
+        self, payload: CreateUserPayload, timeout: aiohttp.ClientTimeout
+    ) -> CreateUserResult:
+        async with self.aio_session.post(
+            "user",
+            json=payload.model_dump(),
+            timeout=timeout,
+        ) as response:
+            if response.status == USER_EXISTS_STATUS:
+                self.user_cache.invalidate(payload.user_id)
                 return CreateUserResult(
+                    existed=True,
                     status=response.status,
-                    message=data.get("message"),
+                    message="User already exists",
                 )
-        except Exception as e:
-            return e
+            response.raise_for_status()
+
+            data = await read_json(response)
+
+            # * Drop any cached (negative) lookup so the new user is fetched next time
+            self.user_cache.invalidate(payload.user_id)
+
+            return CreateUserResult(
+                status=response.status,
+                message=data.get("message"),
+            )
+
+    async def export_user_ids(self) -> Union[ExportUserIdsResult, Exception]:
+        """Ids of all registered users, in one bulk request"""
+        return await self._call(
+            "export_user_ids", self._export_user_ids, idempotent=True
+        )
+
+    async def _export_user_ids(
+        self, timeout: aiohttp.ClientTimeout
+    ) -> ExportUserIdsResult:
+        async with self.aio_session.get("user/ids", timeout=timeout) as response:
+            response.raise_for_status()
+            body = await response.read()
+
+        # * Decoding and validating every registered id would hold up the event loop
+        return await asyncio.to_thread(user_ids_from_body, body, response.status)
 
     async def create_chat(
-        self, payload: CreateChatPayload
+        self,
+        payload: CreateChatPayload,
+        coalesce: bool = False,
+        deadline: Optional[Deadline] = None,
     ) -> Union[CreateChatResult, Exception]:
-        try:
-            async with self.aio_session.post(
-                "chat",
-                json=payload.model_dump(),
-            ) as response:
-                response.raise_for_status()
-                res = await response.json()
+        return await self._request(
+            "create_chat",
+            payload,
+            lambda timeout: self._create_chat(payload, timeout),
+            idempotent=False,
+            coalesce=coalesce,
+            deadline=deadline,
+        )
 
-                return CreateChatResult(
-                    status=response.status,
-                    message=res.get("message"),
-                )
-        except Exception as e:
-            return e
+    async def _create_chat(
+        self, payload: CreateChatPayload, timeout: aiohttp.ClientTimeout
+    ) -> CreateChatResult:
+        async with self.aio_session.post(
+            "chat",
+            json=payload.model_dump(),
+            timeout=timeout,
+        ) as response:
+            response.raise_for_status()
+            res = await read_json(response)
+
+            return CreateChatResult(
+                status=response.status,
+                message=res.get("message"),
+            )
 
     async def add_member(
-        self, payload: AddMemberPayload
+        self,
+        payload: AddMemberPayload,
+        coalesce: bool = False,
+        deadline: Optional[Deadline] = None,
     ) -> Union[AddMemberResult, Exception]:
-        try:
-            async with self.aio_session.patch(
-                f"chat/{payload.chat_id}/members",
-                json={
-                    "user_id": payload.user_id,
-                    "first_name": payload.first_name,
-                    "last_name": payload.last_name,
-                    "username": payload.username,
-                },
-            ) as response:
-                response.raise_for_status()
-                res = await response.json()
+        return await self._request(
+            "add_member",
+            payload,
+            lambda timeout: self._add_member(payload, timeout),
+            idempotent=True,
+            coalesce=coalesce,
+            deadline=deadline,
+        )
 
-                return AddMemberResult(
-                    status=response.status,
-                    message=res.get("message"),
+    async def _add_member(
+        self, payload: AddMemberPayload, timeout: aiohttp.ClientTimeout
+    ) -> AddMemberResult:
+        async with self.aio_session.patch(
+            f"chat/{payload.chat_id}/members",
+            json={
+                "user_id": payload.user_id,
+                "first_name": payload.first_name,
+                "last_name": payload.last_name,
+                "username": payload.username,
+            },
+            timeout=timeout,
+        ) as response:
+            response.raise_for_status()
+            res = await read_json(response)
+
+            return AddMemberResult(
+                status=response.status,
+                message=res.get("message"),
+            )
+
+    async def add_members_bulk(
+        self, payload: AddMembersBulkPayload, deadline: Optional[Deadline] = None
+    ) -> List[Union[AddMemberResult, Exception]]:
+        """Add all members in one request, returning one result per member in order.
+
+        Falls back to per-member requests with bounded concurrency when the backend
+        does not support the bulk endpoint, which is tried again after
+        `API_BULK_REPROBE_INTERVAL`.
+        """
+        if not payload.members:
+            return []
+
+        if time.monotonic() >= self.bulk_add_members_unsupported_until:
+            result = await self._request(
+                "add_members_bulk",
+                payload,
+                lambda timeout: self._add_members_bulk(payload, timeout),
+                idempotent=True,
+                deadline=deadline,
+            )
+            if not isinstance(result, Exception):
+                return result
+            if (
+                not isinstance(result, aiohttp.ClientResponseError)
+                or result.status not in BULK_UNSUPPORTED_STATUSES
+            ):
+                return [result for _ in payload.members]
+            self.bulk_add_members_unsupported_until = (
+                time.monotonic() + env.API_BULK_REPROBE_INTERVAL
+            )
+
+        semaphore = asyncio.Semaphore(env.API_ADD_MEMBERS_CONCURRENCY)
+
+        async def add_one(member: MemberPayload):
+            async with semaphore:
+                return await self.add_member(
+                    AddMemberPayload(chat_id=payload.chat_id, **member.model_dump()),
+                    deadline=deadline,
                 )
-        except Exception as e:
-            return e
+
+        return list(
+            await asyncio.gather(*[add_one(member) for member in payload.members])
+        )
+
+    async def _add_members_bulk(
+        self, payload: AddMembersBulkPayload, timeout: aiohttp.ClientTimeout
+    ) -> List[Union[AddMemberResult, Exception]]:
+        async with self.aio_session.patch(
+            f"chat/{payload.chat_id}/members/bulk",
+            json={"members": [member.model_dump() for member in payload.members]},
+            timeout=timeout,
+        ) as response:
+            if response.status == 404:
+                # * A 404 carrying the backend's own message is about the chat, a
+                # * missing route has no such body and still means unsupported
+                res = await read_json_or_none(response)
+                if isinstance(res, dict) and res.get("message"):
+                    error = ApiError(status=response.status, message=res["message"])
+                    return [error for _ in payload.members]
+            response.raise_for_status()
+            res = await read_json(response)
+
+            # * Per member outcomes keyed by user_id, members missing from it succeeded
+            outcomes = {item.get("user_id"): item for item in (res.get("data") or [])}
+            results: List[Union[AddMemberResult, Exception]] = []
+            for member in payload.members:
+                outcome = outcomes.get(member.user_id, {})
+                status = outcome.get("status", response.status)
+                message = outcome.get("message", res.get("message"))
+                if status >= 400:
+                    results.append(ApiError(status=status, message=message))
+                else:
+                    results.append(AddMemberResult(status=status, message=message))
+            return results
+
+    async def get_ledger(
+        self, payload: GetLedgerPayload, deadline: Optional[Deadline] = None
+    ) -> Union[GetLedgerResult, Exception]:
+        return await self._request(
+            "get_ledger",
+            payload,
+            lambda timeout: self._get_ledger(payload, timeout),
+            idempotent=True,
+            coalesce=True,
+            deadline=deadline,
+        )
+
+    async def _get_ledger(
+        self, payload: GetLedgerPayload, timeout: aiohttp.ClientTimeout
+    ) -> GetLedgerResult:
+        async with self.aio_session.get(
+            f"chat/{payload.chat_id}/expenses", timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            res = await read_json(response)
+            data = res.get("data") or {}
+
+            # * Flatten expenses into the columnar ledger, amounts come in dollars
+            payer_ids: List[int] = []
+            amounts: List[float] = []
+            share_user_ids: List[int] = []
+            share_amounts: List[float] = []
+            for expense in data.get("expenses") or []:
+                payer_ids.append(expense["payerId"])
+                amounts.append(expense["amount"])
+                for share in expense.get("shares") or []:
+                    share_user_ids.append(share["userId"])
+                    share_amounts.append(share["amount"])
+
+            return GetLedgerResult(
+                members=[
+                    user_from_data(member) for member in data.get("members") or []
+                ],
+                ledger=Ledger(
+                    payer_ids=payer_ids,
+                    amounts=to_cents(amounts),
+                    share_user_ids=share_user_ids,
+                    share_amounts=to_cents(share_amounts),
+                ),
+                version=data.get("version", 0),
+                status=response.status,
+                message=res.get("message"),
+            )
+
+    async def get_expense_events(
+        self, payload: GetExpenseEventsPayload, deadline: Optional[Deadline] = None
+    ) -> Union[GetExpenseEventsResult, Exception]:
+        return await self._request(
+            "get_expense_events",
+            payload,
+            lambda timeout: self._get_expense_events(payload, timeout),
+            idempotent=True,
+            coalesce=True,
+            deadline=deadline,
+        )
+
+    async def _get_expense_events(
+        self, payload: GetExpenseEventsPayload, timeout: aiohttp.ClientTimeout
+    ) -> GetExpenseEventsResult:
+        async with self.aio_session.get(
+            f"chat/{payload.chat_id}/expenses/events",
+            params={"since": payload.since_version},
+            timeout=timeout,
+        ) as response:
+            response.raise_for_status()
+            res = await read_json(response)
+            data = res.get("data") or {}
+
+            return GetExpenseEventsResult(
+                events=[
+                    expense_event_from_data(event) for event in data.get("events") or []
+                ],
+                members=[
+                    user_from_data(member) for member in data.get("members") or []
+                ],
+                status=response.status,
+                message=res.get("message"),
+            )
 
     async def clean_up(self):
-        await self.aio_session.close()
+        if self._aio_session is not None:
+            await self._aio_session.close()
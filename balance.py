@@ -0,0 +1,160 @@
+import heapq
+from types import ModuleType
+from typing import TYPE_CHECKING, Dict, Iterable, List, Literal, Optional, Tuple
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_numpy: Optional[ModuleType] = None
+
+
+def numpy() -> ModuleType:
+    """numpy, imported on first use, it is the largest import on the startup path"""
+    global _numpy
+    if _numpy is None:
+        import numpy
+
+        _numpy = numpy
+    return _numpy
+
+
+class Settlement(BaseModel):
+    debtor_id: int
+    creditor_id: int
+    amount: int  # in cents
+
+
+class BalanceSheet(BaseModel):
+    # * Net position per user in cents, positive means the user is owed money
+    net: Dict[int, int]
+    settlements: List[Settlement]
+
+
+class Share(BaseModel):
+    user_id: int
+    amount: int  # in cents
+
+
+class ExpenseSnapshot(BaseModel):
+    payer_id: int
+    amount: int  # in cents
+    shares: List[Share]
+
+
+class ExpenseEvent(BaseModel):
+    # * Per chat version of the ledger after this event was applied
+    version: int
+    kind: Literal["created", "updated", "deleted"]
+    # * State of the expense after (created, updated) and before (updated, deleted)
+    expense: Optional[ExpenseSnapshot] = Field(default=None)
+    previous: Optional[ExpenseSnapshot] = Field(default=None)
+
+
+def to_cents(amounts: Iterable[float]) -> "np.ndarray":
+    np = numpy()
+
+    return np.rint(np.fromiter(amounts, dtype=np.float64) * 100).astype(np.int64)
+
+
+class Ledger:
+    """Columnar expense ledger with amounts in cents.
+
+    Each expense has one payer and any number of shares, the shares of all
+    expenses are flattened into parallel arrays.
+    """
+
+    def __init__(
+        self,
+        payer_ids: Iterable[int],
+        amounts: Iterable[int],
+        share_user_ids: Iterable[int],
+        share_amounts: Iterable[int],
+    ):
+        np = numpy()
+        self.payer_ids = np.asarray(payer_ids, dtype=np.int64)
+        self.amounts = np.asarray(amounts, dtype=np.int64)
+        self.share_user_ids = np.asarray(share_user_ids, dtype=np.int64)
+        self.share_amounts = np.asarray(share_amounts, dtype=np.int64)
+
+        if len(self.payer_ids) != len(self.amounts):
+            raise ValueError("Ledger payer_ids and amounts must have the same length")
+        if len(self.share_user_ids) != len(self.share_amounts):
+            raise ValueError(
+                "Ledger share_user_ids and share_amounts must have the same length"
+            )
+
+    def __len__(self) -> int:
+        return len(self.payer_ids)
+
+
+def net_balances(ledger: Ledger) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Return the sorted user ids and their net position in cents"""
+    np = numpy()
+
+    n_payers = len(ledger.payer_ids)
+    user_ids, index = np.unique(
+        np.concatenate([ledger.payer_ids, ledger.share_user_ids]), return_inverse=True
+    )
+
+    # float64 sums are exact for integer cents well beyond any realistic ledger
+    paid = np.bincount(
+        index[:n_payers], weights=ledger.amounts, minlength=len(user_ids)
+    )
+    owed = np.bincount(
+        index[n_payers:], weights=ledger.share_amounts, minlength=len(user_ids)
+    )
+    return user_ids, np.rint(paid - owed).astype(np.int64)
+
+
+def simplify(user_ids: "np.ndarray", net: "np.ndarray") -> List[Settlement]:
+    """Settlements clearing the given net positions.
+
+    Greedily settles the largest debtor against the largest creditor, which needs
+    at most one transfer less than the number of users with a non zero position.
+    This bounds the transfers but is not always the fewest possible, finding that
+    minimum is NP-hard.
+    """
+    creditors_mask = net > 0
+    debtors_mask = net < 0
+
+    # * Max heaps through negated amounts
+    creditors = list(
+        zip((-net[creditors_mask]).tolist(), user_ids[creditors_mask].tolist())
+    )
+    debtors = list(zip(net[debtors_mask].tolist(), user_ids[debtors_mask].tolist()))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    settlements: List[Settlement] = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+
+        amount = min(-credit, -debt)
+        settlements.append(
+            Settlement(debtor_id=debtor_id, creditor_id=creditor_id, amount=amount)
+        )
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+
+    return settlements
+
+
+def debts_by_debtor(settlements: Iterable[Settlement]) -> Dict[int, List[Settlement]]:
+    """Group settlements per debtor, in the order they were produced"""
+    debts: Dict[int, List[Settlement]] = {}
+    for settlement in settlements:
+        debts.setdefault(settlement.debtor_id, []).append(settlement)
+    return debts
+
+
+def compute_balances(ledger: Ledger) -> BalanceSheet:
+    user_ids, net = net_balances(ledger)
+    return BalanceSheet(
+        net=dict(zip(user_ids.tolist(), net.tolist())),
+        settlements=simplify(user_ids, net),
+    )
@@ -0,0 +1,131 @@
+import logging
+from typing import Dict, Optional, Union
+from api import Api, GetExpenseEventsPayload, GetLedgerPayload
+from balance import (
+    BalanceSheet,
+    ExpenseEvent,
+    ExpenseSnapshot,
+    Ledger,
+    net_balances,
+    numpy,
+    simplify,
+)
+from cache import TTLCache
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+
+class GroupBalance:
+    """Net balances of one group, maintained incrementally from expense events"""
+
+    def __init__(self, version: int, net: Dict[int, int], names: Dict[int, str]):
+        self.version = version
+        self.net = net
+        self.names = names
+
+    @classmethod
+    def from_ledger(
+        cls, ledger: Ledger, version: int, names: Dict[int, str]
+    ) -> "GroupBalance":
+        user_ids, net = net_balances(ledger)
+        return cls(version, dict(zip(user_ids.tolist(), net.tolist())), names)
+
+    def apply(self, event: ExpenseEvent) -> bool:
+        """Apply the event, returns False when the state can not be trusted anymore
+        and needs a full resync (missed version or incomplete event)"""
+        if event.version <= self.version:
+            # Already applied, e.g. by a concurrent read of the change feed
+            return True
+        if event.version != self.version + 1:
+            return False
+
+        if event.kind in ("updated", "deleted"):
+            if event.previous is None:
+                return False
+            self._add(event.previous, -1)
+        if event.kind in ("created", "updated"):
+            if event.expense is None:
+                return False
+            self._add(event.expense, 1)
+
+        self.version = event.version
+        return True
+
+    def _add(self, expense: ExpenseSnapshot, sign: int):
+        self.net[expense.payer_id] = (
+            self.net.get(expense.payer_id, 0) + sign * expense.amount
+        )
+        for share in expense.shares:
+            self.net[share.user_id] = (
+                self.net.get(share.user_id, 0) - sign * share.amount
+            )
+
+    def balance_sheet(self) -> BalanceSheet:
+        np = numpy()
+        user_ids = np.fromiter(self.net.keys(), dtype=np.int64, count=len(self.net))
+        net = np.fromiter(self.net.values(), dtype=np.int64, count=len(self.net))
+        return BalanceSheet(net=dict(self.net), settlements=simplify(user_ids, net))
+
+
+class BalanceStore:
+    """Per chat balance state, kept current from expense events.
+
+    Every read catches up through the backend change feed first, fetching only the
+    events since the version it holds. Whenever a version is missed the chat is
+    resynced from its full ledger, so reads never serve a balance computed from an
+    incomplete history.
+    """
+
+    def __init__(self, api: Api, max_groups: int = 10_000):
+        self.api = api
+        # * Evicted or expired groups are simply resynced on their next read
+        self.states: TTLCache[int, GroupBalance] = TTLCache(
+            max_size=max_groups, ttl=float("inf")
+        )
+        self.resyncs = 0
+
+    async def get(
+        self, chat_id: int, deadline: Optional[Deadline] = None
+    ) -> Union[GroupBalance, Exception]:
+        state = self.states.get(chat_id)
+        if state is None:
+            return await self.resync(chat_id, deadline)
+
+        feed = await self.api.get_expense_events(
+            GetExpenseEventsPayload(chat_id=chat_id, since_version=state.version),
+            deadline=deadline,
+        )
+        if isinstance(feed, Exception):
+            return feed
+
+        state.names.update({member.id: member.first_name for member in feed.members})
+        for event in feed.events:
+            if not state.apply(event):
+                self.states.invalidate(chat_id)
+                return await self.resync(chat_id, deadline)
+        return state
+
+    async def resync(
+        self, chat_id: int, deadline: Optional[Deadline] = None
+    ) -> Union[GroupBalance, Exception]:
+        self.resyncs += 1
+        result = await self.api.get_ledger(
+            GetLedgerPayload(chat_id=chat_id), deadline=deadline
+        )
+        if isinstance(result, Exception):
+            self.states.invalidate(chat_id)
+            return result
+
+        current = self.states.get(chat_id)
+        if current is not None and current.version >= result.version:
+            # A concurrent resync already brought the state at least this far
+            return current
+
+        state = GroupBalance.from_ledger(
+            result.ledger,
+            version=result.version,
+            names={member.id: member.first_name for member in result.members},
+        )
+        self.states.set(chat_id, state)
+        return state
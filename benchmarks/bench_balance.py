@@ -0,0 +1,64 @@
+"""Benchmark of the balance engine over synthetic group ledgers.
+
+Usage: python benchmarks/bench_balance.py [seed]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np  # noqa: E402
+from balance import Ledger, compute_balances  # noqa: E402
+
+SCENARIOS = [
+    # (members, expenses)
+    (10, 100),
+    (50, 2_000),
+    (200, 10_000),
+    (500, 50_000),
+]
+
+
+def synthetic_ledger(rng: np.random.Generator, members: int, expenses: int) -> Ledger:
+    """Random expenses, each split evenly between 2 to 10 members"""
+    user_ids = rng.choice(10**10, size=members, replace=False).astype(np.int64)
+    payer_ids = rng.choice(user_ids, size=expenses)
+    split_sizes = rng.integers(2, min(10, members) + 1, size=expenses)
+    amounts = rng.integers(100, 50_000, size=expenses) // split_sizes * split_sizes
+
+    share_user_ids = rng.choice(user_ids, size=int(split_sizes.sum()))
+    share_amounts = np.repeat(amounts // split_sizes, split_sizes)
+    return Ledger(payer_ids, amounts, share_user_ids, share_amounts)
+
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    rng = np.random.default_rng(seed)
+
+    for members, expenses in SCENARIOS:
+        ledger = synthetic_ledger(rng, members, expenses)
+
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            balance_sheet = compute_balances(ledger)
+            timings.append(time.perf_counter() - started)
+
+        # Sanity check, the settlements must clear every net position
+        remaining = dict(balance_sheet.net)
+        for settlement in balance_sheet.settlements:
+            remaining[settlement.debtor_id] += settlement.amount
+            remaining[settlement.creditor_id] -= settlement.amount
+        assert not any(remaining.values()), "settlements do not clear the ledger"
+
+        print(
+            f"members={members:<4} expenses={expenses:<6} "
+            f"settlements={len(balance_sheet.settlements):<4} "
+            f"best={min(timings) * 1000:7.2f}ms median={sorted(timings)[2] * 1000:7.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Microbenchmark of the Api encode/decode path.
+
+Compares the previous path (stdlib json + validated pydantic models) with the
+configured codec.
+
+Usage: python benchmarks/bench_codec.py [iterations]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The Api module reads its settings from env on import
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("MINI_APP_DEEPLINK", "https://t.me/{botusername}")
+os.environ.setdefault("API_BASE_URL", "http://localhost/")
+os.environ.setdefault("API_KEY", "bench")
+
+import codec  # noqa: E402
+from api import CreateUserPayload, GetUserResult, User  # noqa: E402
+
+PAYLOAD = CreateUserPayload(
+    user_id=257256809, first_name="Bubu", last_name="Ding", username="bubuding"
+)
+RESPONSE_BODY = json.dumps(
+    {
+        "message": "User found",
+        "data": {
+            "id": 257256809,
+            "firstName": "Bubu",
+            "lastName": "Ding",
+            "username": "bubuding",
+            "createdAt": "2024-12-24T10:00:00.000Z",
+            "updatedAt": "2024-12-24T10:00:00.000Z",
+        },
+    }
+).encode("utf-8")
+
+
+def get_user_result(data: dict) -> GetUserResult:
+    user_data = data["data"]
+    return GetUserResult(
+        user=User(
+            id=user_data.get("id"),
+            first_name=user_data.get("firstName"),
+            last_name=user_data.get("lastName"),
+            username=user_data.get("username"),
+            created_at=user_data.get("createdAt"),
+            updated_at=user_data.get("updatedAt"),
+        ),
+        status=200,
+        message=data.get("message"),
+    )
+
+
+def baseline():
+    json.dumps(PAYLOAD.model_dump())
+    get_user_result(json.loads(RESPONSE_BODY.decode("utf-8")))
+
+
+def fast_codec():
+    codec.dumps(PAYLOAD.model_dump())
+    get_user_result(codec.loads(RESPONSE_BODY))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    print(f"codec: {codec.NAME}, iterations: {iterations}")
+    base = None
+    for name, fn in [
+        ("stdlib json + validation", baseline),
+        (f"{codec.NAME} + validation", fast_codec),
+    ]:
+        per_call = min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations
+        base = base or per_call
+        print(
+            f"{name:<32} {per_call * 1e6:8.2f} us/call"
+            f"  ({(1 - per_call / base) * 100:5.1f}% saved)"
+        )
+
+
+if __name__ == "__main__":
+    main()
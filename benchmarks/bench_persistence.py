@@ -0,0 +1,88 @@
+"""Benchmark of the user_data persistence backends.
+
+Replays update cycles where a share of the known users touch their user_data,
+the way the Application hands marked users to its persistence, and reports how
+long the event loop is blocked per cycle and how long a final flush takes.
+
+Compares PicklePersistence (writing on every update and on flush only) with the
+SQLite write-behind persistence.
+
+Usage: python benchmarks/bench_persistence.py [users] [cycles]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram.ext import (  # noqa: E402
+    BasePersistence,
+    PersistenceInput,
+    PicklePersistence,
+)
+from persistence import SqliteStore, WriteBehindPersistence  # noqa: E402
+
+STORE_DATA = PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+
+
+async def run(persistence: BasePersistence, users: int, cycles: int, active: int):
+    await persistence.get_user_data()
+    user_data = {user_id: {} for user_id in range(users)}
+
+    blocked = []
+    for cycle in range(cycles):
+        started = time.perf_counter()
+        for offset in range(active):
+            user_id = (cycle * active + offset) % users
+            user_data[user_id]["target_group_id"] = -1000000000 - cycle
+            await persistence.update_user_data(user_id, user_data[user_id])
+        # Users marked by updates that did not change their data
+        for offset in range(active):
+            user_id = (cycle * active + offset + users // 2) % users
+            await persistence.update_user_data(user_id, user_data[user_id])
+        blocked.append(time.perf_counter() - started)
+        # Give background writers a chance to run, like the idle loop between updates
+        await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await persistence.flush()
+    flushed = time.perf_counter() - started
+
+    blocked.sort()
+    return blocked[len(blocked) // 2], blocked[-1], flushed
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    active = max(1, users // 100)
+    print(f"{users} users, {cycles} cycles of {active} changed + {active} unchanged")
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            "pickle (write on update)": lambda: PicklePersistence(
+                os.path.join(directory, "update.pickle"), store_data=STORE_DATA
+            ),
+            "pickle (write on flush)": lambda: PicklePersistence(
+                os.path.join(directory, "flush.pickle"),
+                store_data=STORE_DATA,
+                on_flush=True,
+            ),
+            "sqlite write-behind": lambda: WriteBehindPersistence(
+                SqliteStore(os.path.join(directory, "store.sqlite3")),
+                store_data=STORE_DATA,
+            ),
+        }
+        for name, backend in backends.items():
+            median, worst, flushed = asyncio.run(run(backend(), users, cycles, active))
+            print(
+                f"{name:>26}: loop blocked per cycle median {median * 1000:8.2f}ms"
+                f"  max {worst * 1000:8.2f}ms  final flush {flushed * 1000:8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark of the bot's cold start, up to ready to take updates.
+
+Starts fresh interpreters which import the bot, build the Application and run
+initialize + post_init against a local fake Bot API, and reports the time of
+each phase and the wall time from spawning the process to ready. Runs once with
+no stored commands hash (first boot) and then with it (every later boot), and
+counts the setMyCommands calls each made.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from fakes import FakeBotApi
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CHILD = """
+import time
+started = time.perf_counter()
+import asyncio, json, bot
+imported = time.perf_counter()
+application, _ = bot.build_application()
+built = time.perf_counter()
+
+async def ready():
+    await application.initialize()
+    await application.post_init(application)
+    initialized = time.perf_counter()
+    print(json.dumps({
+        "import": imported - started,
+        "build": built - imported,
+        "initialize": initialized - built,
+    }), flush=True)
+    await application.shutdown()
+
+asyncio.run(ready())
+"""
+
+
+def run_once(environ: Dict[str, str]) -> Dict[str, float]:
+    spawned = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", CHILD],
+        cwd=ROOT,
+        env=environ,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    assert process.stdout is not None
+    phases: Dict[str, float] = {}
+    for line in process.stdout:
+        if line.startswith("{") and '"import"' in line:
+            phases = json.loads(line)
+            phases["ready"] = time.perf_counter() - spawned
+    process.wait()
+    if not phases:
+        raise RuntimeError("The bot did not start, run it directly to see why")
+    return phases
+
+
+def report(name: str, runs: List[Dict[str, float]], set_commands: int):
+    print(f"{name} ({len(runs)} runs, {set_commands} setMyCommands calls)")
+    for phase in ("import", "build", "initialize", "ready"):
+        values = sorted(run[phase] for run in runs)
+        print(
+            f"  {phase:>10}: median {values[len(values) // 2] * 1000:7.1f}ms"
+            f"  min {values[0] * 1000:7.1f}ms"
+        )
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    port = 18_500
+    fake = FakeBotApi()
+    fake.start_in_thread(port)
+
+    with tempfile.TemporaryDirectory() as directory:
+        environ = {
+            **os.environ,
+            "ENV": "development",
+            "TELEGRAM_BOT_TOKEN": "1:bench",
+            "MINI_APP_DEEPLINK": "https://t.me/{botusername}",
+            "API_BASE_URL": "http://127.0.0.1:1/",
+            "API_KEY": "bench",
+            "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{port}/bot",
+            "PERSISTENCE_PATH": os.path.join(directory, "bench.sqlite3"),
+            "COMMANDS_HASH_PATH": os.path.join(directory, "commands"),
+            "KNOWN_USERS_PATH": os.path.join(directory, "users"),
+        }
+
+        first_boots = []
+        for _ in range(runs):
+            if os.path.exists(environ["COMMANDS_HASH_PATH"]):
+                os.remove(environ["COMMANDS_HASH_PATH"])
+            first_boots.append(run_once(environ))
+        report("first boot", first_boots, fake.calls.pop("setMyCommands", 0))
+
+        later_boots = [run_once(environ) for _ in range(runs)]
+        report("later boots", later_boots, fake.calls.pop("setMyCommands", 0))
+
+
+if __name__ == "__main__":
+    main()
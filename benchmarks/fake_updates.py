@@ -0,0 +1,256 @@
+"""Fake webhook update source for the sharded webhook.
+
+Posts synthetic /help updates for a number of chats, each chat's updates in
+sequence and chats concurrently, the way Telegram delivers them, and reports
+throughput, latency and response statuses.
+
+Without a target URL it starts a front receiver with fake workers in process,
+so sharding and per chat ordering can be checked without Telegram or the bot.
+Like a bot worker, a fake worker hands each update to an `UpdateScheduler` and
+answers once it is handled or after `--reply-wait-ms`, whichever comes first,
+so handlers slower than the reply wait keep running after the front moved on to
+the chat's next update. Workers record when each update's handling starts and
+ends, to check each chat is handled in order and one update at a time.
+
+Usage: python benchmarks/fake_updates.py [--url URL] [--secret SECRET]
+           [--chats 200] [--updates 20] [--workers 4]
+           [--handle-ms 50] [--reply-wait-ms 10]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from telegram import Update  # noqa: E402
+import codec  # noqa: E402
+from sharding import FrontReceiver, shard_key  # noqa: E402
+from update_scheduler import UpdateScheduler  # noqa: E402
+from webhook import SECRET_TOKEN_HEADER  # noqa: E402
+
+
+def fake_update(update_id: int, chat_id: int, sequence: int) -> Dict:
+    chat_type = "group" if chat_id < 0 else "private"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": sequence,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type, "title": f"Chat {chat_id}"},
+            "from": {"id": abs(chat_id), "is_bot": False, "first_name": "Fake"},
+            "text": "/help",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    }
+
+
+class FakeWorker:
+    """Stands in for a bot worker, handling each update for up to `handle` seconds
+    and answering after at most `reply_wait` seconds, like `webhook.run_webhook`"""
+
+    def __init__(self, index: int, handle: float, reply_wait: float):
+        self.index = index
+        self.handle = handle
+        self.reply_wait = reply_wait
+        self.scheduler = UpdateScheduler()
+        self.answered_early = 0
+        # * Per chat: (sequence, handling started, handling finished)
+        self.seen: Dict[int, List[Tuple[int, float, float]]] = {}
+
+    async def receive(self, request: web.Request) -> web.Response:
+        data = codec.loads(await request.read())
+        chat_id = shard_key(data)
+        handled = asyncio.get_running_loop().create_future()
+        await self.scheduler.process_update(
+            Update.de_json(data, None),
+            self.handle_update(chat_id, data["message"]["message_id"], handled),
+        )
+        try:
+            await asyncio.wait_for(asyncio.shield(handled), timeout=self.reply_wait)
+        except asyncio.TimeoutError:
+            # * Still being handled, the front moves on to the chat's next update
+            self.answered_early += 1
+        return web.Response()
+
+    async def handle_update(
+        self, chat_id: int, sequence: int, handled: "asyncio.Future[None]"
+    ):
+        started = time.perf_counter()
+        await asyncio.sleep(random.uniform(0, self.handle))
+        self.seen.setdefault(chat_id, []).append(
+            (sequence, started, time.perf_counter())
+        )
+        handled.set_result(None)
+
+
+async def start_local(
+    workers: int, port: int, secret: str, handle: float, reply_wait: float
+) -> "tuple[List[FakeWorker], FrontReceiver, List[web.AppRunner]]":
+    runners = []
+    fakes = [FakeWorker(index, handle, reply_wait) for index in range(workers)]
+    for index, fake in enumerate(fakes):
+        app = web.Application()
+        app.router.add_post("/", fake.receive)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port + 1 + index).start()
+        runners.append(runner)
+
+    front = FrontReceiver(
+        [f"http://127.0.0.1:{port + 1 + index}/" for index in range(workers)], secret
+    )
+    app = web.Application()
+    app.router.add_post("/", front.receive)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    runners.append(runner)
+    return fakes, front, runners
+
+
+async def send_chat(
+    session: aiohttp.ClientSession,
+    url: str,
+    secret: str,
+    chat_id: int,
+    updates: int,
+    next_update_id,
+    latencies: List[float],
+    statuses: Dict[int, int],
+):
+    for sequence in range(updates):
+        body = codec.dumps(fake_update(next(next_update_id), chat_id, sequence))
+        started = time.perf_counter()
+        async with session.post(
+            url,
+            data=body,
+            headers={SECRET_TOKEN_HEADER: secret, "Content-Type": "application/json"},
+        ) as response:
+            await response.read()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(
+    url: Optional[str],
+    secret: str,
+    chats: int,
+    updates: int,
+    workers: int,
+    handle: float,
+    reply_wait: float,
+):
+    fakes: List[FakeWorker] = []
+    front = None
+    runners: List[web.AppRunner] = []
+    if url is None:
+        port = 18_400
+        fakes, front, runners = await start_local(
+            workers, port, secret, handle, reply_wait
+        )
+        url = f"http://127.0.0.1:{port}/"
+
+    chat_ids = [
+        -1_000_000_000_000 - index if index % 2 else 100_000 + index
+        for index in range(chats)
+    ]
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    update_ids = iter(range(1, chats * updates + 1))
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100)
+    ) as session:
+        await asyncio.gather(
+            *(
+                send_chat(
+                    session,
+                    url,
+                    secret,
+                    chat_id,
+                    updates,
+                    update_ids,
+                    latencies,
+                    statuses,
+                )
+                for chat_id in chat_ids
+            )
+        )
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    print(
+        f"{total} updates from {chats} chats in {elapsed:.2f}s, {total / elapsed:.0f}/s"
+    )
+    for percentile in (50, 95, 99):
+        index = min(total - 1, total * percentile // 100)
+        print(f"  p{percentile}: {latencies[index] * 1000:.2f}ms")
+    print(f"  statuses: {statuses}")
+
+    if front is not None:
+        # * Let handlers still running after their response finish
+        for fake in fakes:
+            await fake.scheduler.shutdown()
+        print(f"  forwarded per worker: {front.forwarded}")
+        out_of_order = 0
+        overlapping = 0
+        split_chats = 0
+        for chat_id in chat_ids:
+            owners = [fake for fake in fakes if chat_id in fake.seen]
+            if len(owners) != 1:
+                split_chats += 1
+                continue
+            handled = owners[0].seen[chat_id]
+            by_start = sorted(handled, key=lambda item: item[1])
+            out_of_order += [item[0] for item in by_start] != list(range(updates))
+            overlapping += any(
+                later[1] < earlier[2] for earlier, later in zip(by_start, by_start[1:])
+            )
+        answered_early = sum(fake.answered_early for fake in fakes)
+        print(f"  answered before handled: {answered_early}")
+        print(f"  chats split across workers: {split_chats}")
+        print(f"  chats out of order: {out_of_order}")
+        print(f"  chats with overlapping updates: {overlapping}")
+        await front.close()
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="front receiver, a local fake one if not set")
+    parser.add_argument("--secret", default="NotSoSecret")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=20, help="per chat")
+    parser.add_argument("--workers", type=int, default=4, help="local fake workers")
+    parser.add_argument(
+        "--handle-ms", type=float, default=50, help="longest fake handling time"
+    )
+    parser.add_argument(
+        "--reply-wait-ms", type=float, default=10, help="TELEGRAM_WEBHOOK_REPLY_WAIT"
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        run(
+            args.url,
+            args.secret,
+            args.chats,
+            args.updates,
+            args.workers,
+            args.handle_ms / 1000,
+            args.reply_wait_ms / 1000,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
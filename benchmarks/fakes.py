@@ -0,0 +1,357 @@
+"""Local stand-ins for the Bot API and the backend API, for benchmarks.
+
+`FakeBotApi` answers the Bot API methods the bot calls, at the path
+`ApplicationBuilder.base_url` points to (`TELEGRAM_API_BASE_URL`, e.g.
+`http://127.0.0.1:18600/bot`). `FakeBackend` serves the `Api` endpoints
+(`API_BASE_URL`, e.g. `http://127.0.0.1:18601/`), including a synthetic expense
+ledger per group that grows by one expense on every change feed read. Both add
+a configurable latency to every call, the backend also fails a share of calls
+with a 503.
+
+Either runs on the caller's event loop with `start`, or on a thread of its own
+with `start_in_thread` for synchronous callers.
+
+Usage: python benchmarks/fakes.py [--telegram-port 18600] [--backend-port 18601]
+           [--latency-ms 0] [--backend-latency-ms 0] [--backend-error-rate 0]
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeServer(ABC):
+    """Serves an aiohttp app on a port, adding `latency` seconds to each call"""
+
+    def __init__(self, latency: float = 0, jitter: float = 0.5):
+        self.latency = latency
+        # * Share of the latency it varies by, either way
+        self.jitter = jitter
+        self.calls: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @abstractmethod
+    def routes(self, app: web.Application): ...
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def delay(self):
+        if self.latency > 0:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(self.latency + random.uniform(-spread, spread))
+
+    async def start(self, port: int, host: str = "127.0.0.1"):
+        app = web.Application()
+        self.routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self, port: int, host: str = "127.0.0.1"):
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(self.start(port, host))
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+class FakeBotApi(FakeServer):
+    """Answers the Bot API methods the bot uses with plausible results, every other
+    method with True, counting calls per method"""
+
+    def __init__(self, latency: float = 0, jitter: float = 0.5):
+        super().__init__(latency, jitter)
+        self._message_ids = itertools.count(1)
+
+    def routes(self, app: web.Application):
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.count(method)
+        if request.content_type == "application/json":
+            params: Dict[str, Any] = await request.json()
+        else:
+            params = dict(await request.post())
+        await self.delay()
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            return self.message(params)
+        if method == "getChat":
+            return self.chat(int(params["chat_id"]))
+        if method == "getFile":
+            file_id = str(params["file_id"])
+            return {
+                "file_id": file_id,
+                "file_unique_id": f"unique-{file_id}",
+                "file_path": f"photos/{file_id}.jpg",
+            }
+        return True
+
+    def message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message_id = params.get("message_id")
+        return {
+            "message_id": (
+                int(message_id) if message_id is not None else next(self._message_ids)
+            ),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": str(params.get("text", "")),
+        }
+
+    def chat(self, chat_id: int) -> Dict[str, Any]:
+        chat: Dict[str, Any] = {
+            "id": chat_id,
+            "type": "private" if chat_id > 0 else "group",
+            "accent_color_id": 0,
+            "max_reaction_count": 11,
+        }
+        if chat_id < 0:
+            chat["title"] = f"Group {-chat_id}"
+            chat["photo"] = {
+                "small_file_id": f"small{-chat_id}",
+                "small_file_unique_id": f"small-unique{-chat_id}",
+                "big_file_id": f"big{-chat_id}",
+                "big_file_unique_id": f"big-unique{-chat_id}",
+            }
+        else:
+            chat["first_name"] = f"User {chat_id}"
+        return chat
+
+
+class FakeBackend(FakeServer):
+    """Serves the `Api` endpoints, keeping the users and chats created, and fails
+    `error_rate` of the calls with a 503 the client retries"""
+
+    def __init__(self, latency: float = 0, error_rate: float = 0, jitter: float = 0.5):
+        super().__init__(latency, jitter)
+        self.error_rate = error_rate
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.chats: Set[int] = set()
+        self.members: Dict[int, Set[int]] = {}
+        # * Per group expenses, the ledger version is their count
+        self.expenses: Dict[int, List[Dict[str, Any]]] = {}
+        self.errors = 0
+
+    def routes(self, app: web.Application):
+        app.router.add_get("/user/ids", self.export_user_ids)
+        app.router.add_get("/user/{user_id}", self.get_user)
+        app.router.add_post("/user", self.create_user)
+        app.router.add_post("/chat", self.create_chat)
+        app.router.add_patch("/chat/{chat_id}/members", self.add_member)
+        app.router.add_patch("/chat/{chat_id}/members/bulk", self.add_members_bulk)
+        app.router.add_get("/chat/{chat_id}/expenses", self.get_ledger)
+        app.router.add_get("/chat/{chat_id}/expenses/events", self.get_expense_events)
+
+    async def respond(self, name: str) -> Optional[web.Response]:
+        """Delay the call, and return the error response when it is picked to fail"""
+        self.count(name)
+        await self.delay()
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"message": "Unavailable"}, status=503)
+        return None
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        failed = await self.respond("get_user")
+        if failed is not None:
+            return failed
+        user = self.users.get(int(request.match_info["user_id"]))
+        if user is None:
+            return web.json_response({"message": "User not found"}, status=404)
+        return web.json_response({"message": "User found", "data": user})
+
+    async def export_user_ids(self, request: web.Request) -> web.Response:
+        failed = await self.respond("export_user_ids")
+        if failed is not None:
+            return failed
+        return web.json_response({"message": "User ids", "data": list(self.users)})
+
+    async def create_user(self, request: web.Request) -> web.Response:
+        failed = await self.respond("create_user")
+        if failed is not None:
+            return failed
+        payload = await request.json()
+        if payload["user_id"] in self.users:
+            return web.json_response({"message": "User already exists"}, status=409)
+        now = datetime.now(timezone.utc).isoformat()
+        self.users[payload["user_id"]] = {
+            "id": payload["user_id"],
+            "firstName": payload["first_name"],
+            "lastName": payload.get("last_name"),
+            "username": payload.get("username"),
+            "createdAt": now,
+            "updatedAt": now,
+        }
+        return web.json_response({"message": "User created"}, status=201)
+
+    async def create_chat(self, request: web.Request) -> web.Response:
+        failed = await self.respond("create_chat")
+        if failed is not None:
+            return failed
+        payload = await request.json()
+        self.chats.add(payload["chat_id"])
+        return web.json_response({"message": "Chat created"}, status=201)
+
+    async def add_member(self, request: web.Request) -> web.Response:
+        failed = await self.respond("add_member")
+        if failed is not None:
+            return failed
+        payload = await request.json()
+        chat_id = int(request.match_info["chat_id"])
+        self.members.setdefault(chat_id, set()).add(payload["user_id"])
+        return web.json_response({"message": "Member added"})
+
+    async def add_members_bulk(self, request: web.Request) -> web.Response:
+        failed = await self.respond("add_members_bulk")
+        if failed is not None:
+            return failed
+        payload = await request.json()
+        chat_id = int(request.match_info["chat_id"])
+        members = self.members.setdefault(chat_id, set())
+        outcomes = []
+        for member in payload["members"]:
+            members.add(member["user_id"])
+            outcomes.append(
+                {"user_id": member["user_id"], "status": 200, "message": "Added"}
+            )
+        return web.json_response({"message": "Members added", "data": outcomes})
+
+    def ledger_members(self, chat_id: int) -> List[int]:
+        """Members sharing a group's expenses, a few fixed ones per group"""
+        return [abs(chat_id) % 1_000_000 * 10 + index for index in range(5)]
+
+    def member_data(self, user_id: int) -> Dict[str, Any]:
+        return {
+            "id": user_id,
+            "firstName": f"Member {user_id}",
+            "createdAt": "2024-12-24T10:00:00.000Z",
+            "updatedAt": "2024-12-24T10:00:00.000Z",
+        }
+
+    def ledger(self, chat_id: int) -> List[Dict[str, Any]]:
+        expenses = self.expenses.get(chat_id)
+        if expenses is None:
+            expenses = self.expenses[chat_id] = []
+            for _ in range(20):
+                self.add_expense(chat_id)
+        return expenses
+
+    def add_expense(self, chat_id: int):
+        members = self.ledger_members(chat_id)
+        sharing = random.sample(members, random.randint(2, len(members)))
+        share = random.randint(100, 5_000) / 100
+        self.expenses[chat_id].append(
+            {
+                "payerId": random.choice(members),
+                "amount": round(share * len(sharing), 2),
+                "shares": [{"userId": user_id, "amount": share} for user_id in sharing],
+            }
+        )
+
+    async def get_ledger(self, request: web.Request) -> web.Response:
+        failed = await self.respond("get_ledger")
+        if failed is not None:
+            return failed
+        chat_id = int(request.match_info["chat_id"])
+        expenses = self.ledger(chat_id)
+        return web.json_response(
+            {
+                "message": "Expenses",
+                "data": {
+                    "expenses": expenses,
+                    "members": [
+                        self.member_data(user_id)
+                        for user_id in self.ledger_members(chat_id)
+                    ],
+                    "version": len(expenses),
+                },
+            }
+        )
+
+    async def get_expense_events(self, request: web.Request) -> web.Response:
+        failed = await self.respond("get_expense_events")
+        if failed is not None:
+            return failed
+        chat_id = int(request.match_info["chat_id"])
+        since = int(request.query.get("since", 0))
+        # * As if a member added an expense since the last read
+        self.ledger(chat_id)
+        self.add_expense(chat_id)
+        expenses = self.expenses[chat_id]
+        return web.json_response(
+            {
+                "message": "Expense events",
+                "data": {
+                    "events": [
+                        {"version": version + 1, "type": "created", "expense": expense}
+                        for version, expense in enumerate(expenses)
+                        if version + 1 > since
+                    ],
+                    "members": [],
+                },
+            }
+        )
+
+
+async def serve(args: argparse.Namespace):
+    telegram = FakeBotApi(latency=args.latency_ms / 1000)
+    backend = FakeBackend(
+        latency=args.backend_latency_ms / 1000, error_rate=args.backend_error_rate
+    )
+    await telegram.start(args.telegram_port)
+    await backend.start(args.backend_port)
+    print(f"TELEGRAM_API_BASE_URL=http://127.0.0.1:{args.telegram_port}/bot")
+    print(f"API_BASE_URL=http://127.0.0.1:{args.backend_port}/")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(f"Bot API calls: {telegram.calls}")
+        print(f"Backend calls: {backend.calls}, failed: {backend.errors}")
+        await telegram.stop()
+        await backend.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--telegram-port", type=int, default=18_600)
+    parser.add_argument("--backend-port", type=int, default=18_601)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Bot API")
+    parser.add_argument("--backend-latency-ms", type=float, default=0)
+    parser.add_argument("--backend-error-rate", type=float, default=0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+"""End to end load benchmark of the bot behind its webhook.
+
+Starts the fake Bot API and fake backend from `fakes.py`, runs `bot.py` in
+production mode against them, and replays a mix of synthetic update sessions
+into its webhook, each session's updates one after another and sessions
+concurrently:
+
+- start: /start in a private chat, from a new or returning user
+- pin: /pin in a group
+- balance: /balance in a group, which reads the backend's expense change feed
+- users_shared: /start ADD_MEMBER<group> then the users picked for the group
+- new_chat_members: the bot added to a new group
+
+The webhook holds each response until its update is handled (inline replies), so
+the response time is the handling time. Reports throughput and p50/p95/p99 per
+handler, and saves or compares against baselines in benchmarks/baselines/.
+
+Usage: python benchmarks/load_test.py [--sessions 2000] [--concurrency 50]
+           [--mix start=4,pin=2,balance=2,users_shared=1,new_chat_members=1]
+           [--backend-latency-ms 20] [--backend-error-rate 0]
+           [--telegram-latency-ms 20] [--workers 1]
+           [--save NAME] [--compare NAME] [--tolerance 0.1]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+from fakes import BOT_USER, FakeBackend, FakeBotApi
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+SECRET = "LoadTestSecret"
+# * bot.ADD_MEMBER_COMMAND and bot.ADD_MEMBER_REQUEST, not imported to keep the bot
+# * out of this process
+ADD_MEMBER_COMMAND = "ADD_MEMBER"
+ADD_MEMBER_REQUEST = 1
+
+# * (handler, update) pairs of one session, sent in order
+Session = List[Tuple[str, Dict[str, Any]]]
+
+
+def user(user_id: int) -> Dict[str, Any]:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": f"User{user_id}",
+        "username": f"user{user_id}",
+    }
+
+
+def private_chat(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+
+def group_chat(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "type": "group", "title": f"Group {-chat_id}"}
+
+
+def message(chat: Dict[str, Any], user_id: int, **fields: Any) -> Dict[str, Any]:
+    return {
+        "message_id": random.randint(1, 2**31),
+        "date": int(time.time()),
+        "chat": chat,
+        "from": user(user_id),
+        **fields,
+    }
+
+
+def command(chat: Dict[str, Any], user_id: int, text: str) -> Dict[str, Any]:
+    length = len(text.split(" ", 1)[0])
+    return message(
+        chat,
+        user_id,
+        text=text,
+        entities=[{"type": "bot_command", "offset": 0, "length": length}],
+    )
+
+
+class Sessions:
+    """Synthetic sessions, with fresh ids so state builds up the way it would"""
+
+    def __init__(self, groups: int, returning: float):
+        self._user_ids = itertools.count(1_000_000)
+        self._group_ids = itertools.count(1_000_000_000_001)
+        self.groups = [-next(self._group_ids) for _ in range(groups)]
+        self.returning = returning
+        self.started: List[int] = []
+
+    def start(self) -> Session:
+        if self.started and random.random() < self.returning:
+            user_id = random.choice(self.started)
+        else:
+            user_id = next(self._user_ids)
+            self.started.append(user_id)
+        return [("start", command(private_chat(user_id), user_id, "/start"))]
+
+    def pin(self) -> Session:
+        chat_id = random.choice(self.groups)
+        return [("pin", command(group_chat(chat_id), next(self._user_ids), "/pin"))]
+
+    def balance(self) -> Session:
+        chat_id = random.choice(self.groups)
+        return [
+            (
+                "balance",
+                command(group_chat(chat_id), next(self._user_ids), "/balance"),
+            )
+        ]
+
+    def users_shared(self) -> Session:
+        user_id = next(self._user_ids)
+        chat_id = random.choice(self.groups)
+        shared = [
+            {"user_id": next(self._user_ids), "first_name": "Shared"}
+            for _ in range(random.randint(1, 5))
+        ]
+        return [
+            (
+                "add_member",
+                command(
+                    private_chat(user_id),
+                    user_id,
+                    f"/start {ADD_MEMBER_COMMAND}{chat_id}",
+                ),
+            ),
+            (
+                "user_shared",
+                message(
+                    private_chat(user_id),
+                    user_id,
+                    users_shared={"request_id": ADD_MEMBER_REQUEST, "users": shared},
+                ),
+            ),
+        ]
+
+    def new_chat_members(self) -> Session:
+        chat_id = -next(self._group_ids)
+        return [
+            (
+                "bot_added",
+                message(
+                    group_chat(chat_id),
+                    next(self._user_ids),
+                    new_chat_members=[BOT_USER],
+                ),
+            )
+        ]
+
+    def mixed(self, mix: Dict[str, int], count: int) -> Iterator[Session]:
+        kinds: Dict[str, Callable[[], Session]] = {
+            "start": self.start,
+            "pin": self.pin,
+            "balance": self.balance,
+            "users_shared": self.users_shared,
+            "new_chat_members": self.new_chat_members,
+        }
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        for _ in range(count):
+            yield kinds[random.choices(names, weights)[0]]()
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.inline = 0
+
+    def record(self, handler: str, latency: float, ok: bool, inline: bool):
+        self.latencies.setdefault(handler, []).append(latency)
+        if not ok:
+            self.errors[handler] = self.errors.get(handler, 0) + 1
+        self.inline += inline
+
+
+def percentile(values: List[float], percent: int) -> float:
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class Sender:
+    def __init__(self, session: aiohttp.ClientSession, url: str):
+        self.session = session
+        self.url = url
+        self._update_ids = itertools.count(1)
+
+    async def post(self, update: Dict[str, Any]) -> Tuple[int, bytes]:
+        async with self.session.post(
+            self.url,
+            data=json.dumps({"update_id": next(self._update_ids), **update}),
+            headers={
+                "X-Telegram-Bot-Api-Secret-Token": SECRET,
+                "Content-Type": "application/json",
+            },
+        ) as response:
+            return response.status, await response.read()
+
+    async def wait_ready(self, workers: int, process: subprocess.Popen, timeout: float):
+        """Probe every worker with a /help until each answers"""
+        pending = {10_000 + index for index in range(workers)}
+        deadline = time.monotonic() + timeout
+        while pending:
+            if process.poll() is not None:
+                raise RuntimeError("The bot exited while starting")
+            if time.monotonic() > deadline:
+                raise RuntimeError("The bot did not start in time")
+            for chat_id in list(pending):
+                try:
+                    status, _ = await self.post(
+                        {"message": command(private_chat(chat_id), chat_id, "/help")}
+                    )
+                except aiohttp.ClientError:
+                    status = 0
+                if status == 200:
+                    pending.discard(chat_id)
+            await asyncio.sleep(0.1)
+
+    async def run(self, sessions: Iterator[Session], results: Results):
+        for session in sessions:
+            for handler, fields in session:
+                started = time.perf_counter()
+                try:
+                    status, body = await self.post({"message": fields})
+                except aiohttp.ClientError:
+                    status, body = 0, b""
+                results.record(
+                    handler, time.perf_counter() - started, status == 200, bool(body)
+                )
+
+
+def bot_environ(args: argparse.Namespace, directory: str) -> Dict[str, str]:
+    unlimited = "1000000"
+    environ = {
+        **os.environ,
+        "ENV": "production",
+        "PORT": str(args.port),
+        "TELEGRAM_WEBHOOK_URL": f"http://127.0.0.1:{args.port}/",
+        "TELEGRAM_WEBHOOK_SECRET": SECRET,
+        "TELEGRAM_WEBHOOK_REPLY": "true",
+        # * Hold every response until its update is handled
+        "TELEGRAM_WEBHOOK_REPLY_WAIT": "60",
+        "TELEGRAM_BOT_TOKEN": "1:load",
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{args.port + 1}/bot",
+        "API_BASE_URL": f"http://127.0.0.1:{args.port + 2}/",
+        "API_KEY": "load",
+        "MINI_APP_DEEPLINK": "https://t.me/{botusername}/app?startapp={command}",
+        "PERSISTENCE_PATH": os.path.join(directory, "load.sqlite3"),
+        "COMMANDS_HASH_PATH": os.path.join(directory, "commands"),
+        "KNOWN_USERS_PATH": os.path.join(directory, "users"),
+        "WEBHOOK_WORKERS": str(args.workers),
+        "WEBHOOK_WORKER_BASE_PORT": str(args.port + 10),
+        "METRICS_PORT": str(args.port + 50),
+    }
+    if not args.rate_limits:
+        # * Measure the bot, not Telegram's limits
+        environ.update(
+            TELEGRAM_GLOBAL_RATE_LIMIT=unlimited,
+            TELEGRAM_GROUP_RATE_LIMIT=unlimited,
+            TELEGRAM_PRIVATE_RATE_LIMIT=unlimited,
+        )
+    return environ
+
+
+def summary(
+    args: argparse.Namespace, results: Results, elapsed: float
+) -> Dict[str, Any]:
+    handlers = {}
+    for handler, latencies in sorted(results.latencies.items()):
+        latencies.sort()
+        handlers[handler] = {
+            "count": len(latencies),
+            "errors": results.errors.get(handler, 0),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    total = sum(len(latencies) for latencies in results.latencies.values())
+    return {
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "workers": args.workers,
+            "telegram_latency_ms": args.telegram_latency_ms,
+            "backend_latency_ms": args.backend_latency_ms,
+            "backend_error_rate": args.backend_error_rate,
+            "rate_limits": args.rate_limits,
+        },
+        "updates": total,
+        "elapsed_s": elapsed,
+        "throughput": total / elapsed,
+        "inline_replies": results.inline,
+        "handlers": handlers,
+    }
+
+
+def report(result: Dict[str, Any]):
+    print(
+        f"{result['updates']} updates in {result['elapsed_s']:.2f}s,"
+        f" {result['throughput']:.1f}/s, {result['inline_replies']} inline replies"
+    )
+    print(
+        f"  {'handler':<12} {'count':>6} {'errors':>6}"
+        f" {'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for handler, stats in result["handlers"].items():
+        print(
+            f"  {handler:<12} {stats['count']:>6} {stats['errors']:>6}"
+            f" {stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms"
+            f" {stats['p99_ms']:>7.1f}ms"
+        )
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> int:
+    """Print the change against the baseline, returns the number of regressions
+    beyond `tolerance`"""
+
+    def change(current: float, previous: float) -> float:
+        return (current - previous) / previous if previous else 0
+
+    if result["config"] != baseline["config"]:
+        print("  warning: the baseline was run with a different configuration")
+
+    regressions = 0
+    throughput = change(result["throughput"], baseline["throughput"])
+    flag = ""
+    if throughput < -tolerance:
+        regressions += 1
+        flag = "  REGRESSION"
+    print(f"  throughput {throughput:+.1%}{flag}")
+    for handler, stats in result["handlers"].items():
+        previous = baseline["handlers"].get(handler)
+        if previous is None:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            delta = change(stats[key], previous[key])
+            flag = ""
+            # * p99 is too noisy on short runs to fail on
+            if key != "p99_ms" and delta > tolerance:
+                regressions += 1
+                flag = "!"
+            changes.append(f"{key[:3]} {delta:+.1%}{flag}")
+        print(f"  {handler:<12} {'  '.join(changes)}")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    telegram = FakeBotApi(latency=args.telegram_latency_ms / 1000)
+    backend = FakeBackend(
+        latency=args.backend_latency_ms / 1000, error_rate=args.backend_error_rate
+    )
+    await telegram.start(args.port + 1)
+    await backend.start(args.port + 2)
+
+    mix = {
+        name: int(weight)
+        for name, weight in (part.split("=") for part in args.mix.split(","))
+    }
+    sessions = Sessions(args.groups, args.returning).mixed(mix, args.sessions)
+    results = Results()
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "bot.log")
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [sys.executable, "bot.py"],
+                cwd=ROOT,
+                env=bot_environ(args, directory),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        try:
+            async with aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=args.concurrency + args.workers),
+                timeout=aiohttp.ClientTimeout(total=120),
+            ) as session:
+                sender = Sender(session, f"http://127.0.0.1:{args.port}/")
+                await sender.wait_ready(args.workers, process, timeout=60)
+
+                started = time.perf_counter()
+                await asyncio.gather(
+                    *(sender.run(sessions, results) for _ in range(args.concurrency))
+                )
+                elapsed = time.perf_counter() - started
+        except RuntimeError:
+            with open(log_path) as log:
+                print(log.read()[-4000:], file=sys.stderr)
+            raise
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            await telegram.stop()
+            await backend.stop()
+
+    print(f"Bot API calls: {telegram.calls}")
+    print(f"Backend calls: {backend.calls}, failed on purpose: {backend.errors}")
+    return summary(args, results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--mix", default="start=4,pin=2,balance=2,users_shared=1,new_chat_members=1"
+    )
+    parser.add_argument(
+        "--groups", type=int, default=100, help="groups to /pin and /balance in"
+    )
+    parser.add_argument(
+        "--returning", type=float, default=0.3, help="share of /start from known users"
+    )
+    parser.add_argument("--telegram-latency-ms", type=float, default=20)
+    parser.add_argument("--backend-latency-ms", type=float, default=20)
+    parser.add_argument("--backend-error-rate", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="WEBHOOK_WORKERS")
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="keep the bot's Telegram limits"
+    )
+    parser.add_argument(
+        "--port", type=int, default=18_700, help="webhook, fakes on the next two"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="NAME", help="save as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare to a baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative regression"
+    )
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    baseline: Optional[Dict[str, Any]] = None
+    if args.compare:
+        with open(os.path.join(BASELINES, f"{args.compare}.json")) as file:
+            baseline = json.load(file)
+
+    result = asyncio.run(run(args))
+    report(result)
+
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, f"{args.save}.json"), "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Saved baseline {args.save}")
+
+    if baseline is not None:
+        print(f"Against baseline {args.compare}:")
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 import asyncio
-import base64
-import json
 import logging
 import os
-from typing import Optional, cast
+import signal
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 import telegram
 from telegram import (
-    BotCommand,
-    BotCommandScopeAllGroupChats,
-    BotCommandScopeAllPrivateChats,
     KeyboardButtonRequestUsers,
     KeyboardButton,
     ReplyKeyboardMarkup,
@@ -26,19 +32,42 @@ from telegram.ext import (
     MessageHandler,
     filters,
     Application,
+    PersistenceInput,
 )
 from env import env
+from balance import debts_by_debtor
+from balance_state import BalanceStore
+import metrics
+from chase import ChaseTarget, remind_all
+from commands import sync_commands
+from deadline import Deadline, DeadlineExceeded
+from dedup import Deduplicator, SeenUpdates, SqliteSeenStore
+from deeplink import mini_app_command_url, mini_app_markup
+from group_bootstrap import GroupBootstrap
+from known_users import KnownUsers
+import logs
+from profiler import SamplingProfiler, handler_codes
+from rate_limiter import Priority, PriorityRateLimiter
+from update_scheduler import UpdateScheduler
 from api import (
-    AddMemberPayload,
+    AddMembersBulkPayload,
     Api,
-    CreateChatPayload,
     CreateUserPayload,
     GetUserPayload,
+    GetUserResult,
+    MemberPayload,
 )
 
-# * Setup loggin
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+# * Only needed by some deployment modes, imported where used to keep startup lean
+if TYPE_CHECKING:
+    from webhook import InlineReplies
+
+# * Setup logging, written out on a thread of its own so it never blocks the loop
+logs.setup_logging(
+    level=env.LOG_LEVEL,
+    json=env.LOG_FORMAT == "json",
+    rate_limit=env.LOG_RATE_LIMIT,
+    queue_size=env.LOG_QUEUE_SIZE,
 )
 # set higher logging level for httpx to avoid all GET and POST requests being logged
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -99,11 +128,132 @@ ADD_MEMBER_END_MESSAGE = """
 {failed_list}
 """
 
+CHASE_SUMMARY_MESSAGE = """
+✅ Reminded:
+{delivered}
+
+🚫 Blocked me:
+{blocked}
+
+💬 Never started a chat with me:
+{no_conversation}
+
+⚠️ Failed:
+{failed}
+"""
+
+DEADLINE_EXCEEDED_MESSAGE = "⏳ That took too long, please try again in a moment."
+
+# * Seconds a handler waits on the backend before it shows the typing indicator
+TYPING_DELAY = 0.3
+
 CHASE_USER_REQUEST, ADD_MEMBER_REQUEST = range(2)
 ADD_MEMBER_COMMAND = "ADD_MEMBER"
 
 
+def update_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Deadline:
+    """Deadline for handling an update, counting from when it was received rather
+    than from when its handler started"""
+    scheduler = context.application.update_processor
+    received_at = (
+        scheduler.received_at(update)
+        if isinstance(scheduler, UpdateScheduler)
+        else None
+    )
+    return Deadline(env.UPDATE_DEADLINE, started_at=received_at)
+
+
+def reply_inline(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> bool:
+    """Answer inside the webhook response when enabled, saving an outbound request.
+    Returns False when the reply has to be sent normally."""
+    replies: Optional["InlineReplies"] = context.bot_data.get("inline_replies")
+    if replies is None or update.effective_chat is None:
+        return False
+
+    return replies.offer(
+        update, "sendMessage", chat_id=update.effective_chat.id, text=text
+    )
+
+
+@asynccontextmanager
+async def typing_while_waiting(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> AsyncIterator[None]:
+    """Show the typing indicator once the wrapped wait outlasts TYPING_DELAY, and
+    call it off when the wait is over, so it never trails the reply"""
+    chat = update.effective_chat
+    if chat is None:
+        yield
+        return
+
+    async def show_typing():
+        await asyncio.sleep(TYPING_DELAY)
+        await context.bot.send_chat_action(
+            chat_id=chat.id, action=telegram.constants.ChatAction.TYPING
+        )
+
+    task = context.application.create_task(show_typing(), update=update)
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+async def send_pin_message(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, button_text: str
+) -> telegram.Message:
+    chat = cast(telegram.Chat, update.effective_chat)
+    reply_markup = mini_app_markup(
+        context.bot.username, chat.id, chat.type, button_text
+    )
+
+    return await context.bot.send_message(
+        chat_id=chat.id,
+        text="🤑 Split your expense leh 🤑",
+        reply_markup=reply_markup,
+    )
+
+
+async def send_welcome_back(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> telegram.Message:
+    user = cast(telegram.User, update.effective_user)
+    return await context.bot.send_message(
+        chat_id=cast(telegram.Chat, update.effective_chat).id,
+        text=START_MESSAGE_EXISITING.format(first_name=user.first_name),
+        reply_markup=InlineKeyboardMarkup.from_button(
+            InlineKeyboardButton(
+                text="Add to group",
+                url=helpers.create_deep_linked_url(
+                    context.bot.username, "group_add", group=True
+                ),
+            )
+        ),
+    )
+
+
+async def try_pin(pin_message: telegram.Message, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await context.bot.pin_chat_message(
+            chat_id=pin_message.chat_id, message_id=pin_message.id
+        )
+    except telegram.error.BadRequest:
+        await pin_message.reply_text(
+            "📌 Pin this for quick access, or make me admin and run /pin@SplitLehBot again to pin automatically",
+            rate_limit_args=Priority.PIN,
+        )
+
+
+async def pin_mini_app(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, button_text: str
+):
+    """Send the mini app message and try to pin it, meant to run as a background task"""
+    pin_message = await send_pin_message(update, context, button_text)
+    await try_pin(pin_message, context)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update_deadline(update, context)
 
     if update.effective_chat is None:
         return
@@ -111,11 +261,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user is None:
         return
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action=telegram.constants.ChatAction.TYPING,
-    )
-
     # * Handle start process for private bot chat
     # * ==========================================
     if update.effective_chat.type == telegram.constants.ChatType.PRIVATE:
@@ -124,54 +269,90 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if api is None:
             return logger.error("[start]: Api instance not found in bot_data")
 
-        # * Check if user exits
-        get_user_result = await api.get_user(
-            GetUserPayload(user_id=update.effective_user.id)
-        )
-        if isinstance(get_user_result, Exception):
-            logger.error(f"[start] - api.get_user: {get_user_result}")
-            return await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="⚠️ Something went wrong checking user, please try again.",
-            )
+        user_id = update.effective_user.id
+        known_users: Optional[KnownUsers] = context.bot_data.get("known_users")
+
+        # * Known users need no lookup, and users it surely does not know go straight to create
+        exists = known_users.lookup(user_id) if known_users is not None else None
+        looked_up = exists is None
+        if exists is None:
+            # * Check if user exits
+            async with typing_while_waiting(update, context):
+                get_user_result = await api.get_user(
+                    GetUserPayload(user_id=user_id), deadline=deadline
+                )
+            if isinstance(get_user_result, DeadlineExceeded):
+                logger.error("[start] - api.get_user: %s", get_user_result)
+                return await context.bot.send_message(
+                    chat_id=update.effective_chat.id, text=DEADLINE_EXCEEDED_MESSAGE
+                )
+            if isinstance(get_user_result, Exception):
+                logger.error("[start] - api.get_user: %s", get_user_result)
+                return await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text="⚠️ Something went wrong checking user, please try again.",
+                )
+            exists = get_user_result.user is not None
+            if exists and known_users is not None:
+                known_users.add(user_id)
 
         # * User exists - send welcome back message
-        if get_user_result.user is not None:
-            logger.info(f"[start] - api.get_user: User exists: {get_user_result.user}")
-            return await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=START_MESSAGE_EXISITING.format(
-                    first_name=update.effective_user.first_name
-                ),
-                reply_markup=InlineKeyboardMarkup.from_button(
-                    InlineKeyboardButton(
-                        text="Add to group",
-                        url=helpers.create_deep_linked_url(
-                            context.bot.username, "group_add", group=True
-                        ),
-                    )
-                ),
-            )
+        if exists:
+            logger.info("[start] - User exists: %s", user_id)
+            return await send_welcome_back(update, context)
 
         # * User does not exist - create user
         create_user_payload = CreateUserPayload(
-            user_id=update.effective_user.id,
+            user_id=user_id,
             first_name=update.effective_user.first_name,
             last_name=update.effective_user.last_name,
             username=update.effective_user.username,
         )
-        api_result = await api.create_user(create_user_payload)
+        async with typing_while_waiting(update, context):
+            api_result = await api.create_user(
+                create_user_payload, coalesce=True, deadline=deadline
+            )
 
+        # * A user registered since the known users' export, that the backend
+        # * turned down some other way than with USER_EXISTS_STATUS
+        if (
+            isinstance(api_result, Exception)
+            and not isinstance(api_result, DeadlineExceeded)
+            and not looked_up
+        ):
+            get_user_result = await api.get_user(
+                GetUserPayload(user_id=user_id), deadline=deadline
+            )
+            if (
+                isinstance(get_user_result, GetUserResult)
+                and get_user_result.user is not None
+            ):
+                logger.info("[start] - api.get_user: User exists: %s", user_id)
+                if known_users is not None:
+                    known_users.add(user_id)
+                return await send_welcome_back(update, context)
+
+        if isinstance(api_result, DeadlineExceeded):
+            logger.error("[start] - api.create_user: %s", api_result)
+            return await context.bot.send_message(
+                chat_id=update.effective_chat.id, text=DEADLINE_EXCEEDED_MESSAGE
+            )
         if isinstance(api_result, Exception):
-            logger.error(f"[start] - api.create_user: {api_result}")
+            logger.error("[start] - api.create_user: %s", api_result)
             return await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="⚠️ Something went wrong creating user, please try again.",
             )
-        else:
-            logger.info(
-                f"[start] - api.create_user: User created: {api_result.message}"
-            )
+
+        if known_users is not None:
+            known_users.add(user_id)
+
+        # * Registered elsewhere since the known users were last refreshed
+        if api_result.existed:
+            logger.info("[start] - api.create_user: User exists: %s", user_id)
+            return await send_welcome_back(update, context)
+
+        logger.info("[start] - api.create_user: User created: %s", api_result.message)
 
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -201,49 +382,24 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ),
         )
 
-    # * Try to pin the bot for the chat
-    # * ===============================
+    # * Try to pin the bot for the chat, after the reply so it does not hold it up
+    # * ===========================================================================
 
     if env.MINI_APP_DEEPLINK is None:
         logger.error("[pin]: MINI_APP_DEEPLINK was not set, unable to send pin message")
 
-    chat_context = {
-        "chat_id": update.effective_chat.id,
-        "chat_type": update.effective_chat.type,
-    }
-    chat_context_bytes = json.dumps(chat_context).encode("utf-8")
-    base64_encoded = base64.b64encode(chat_context_bytes).decode("utf-8")
-
-    url = env.MINI_APP_DEEPLINK.format(
-        botusername=context.bot.username, mode="compact", command=base64_encoded
+    context.application.create_task(
+        pin_mini_app(update, context, "Expenses 💵"), update=update
     )
-    inline_button = InlineKeyboardButton("Expenses 💵", url=url)
-    reply_markup = InlineKeyboardMarkup.from_button(inline_button)
-
-    pin_message = await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="🤑 Split your expense leh 🤑",
-        reply_markup=reply_markup,
-    )
-
-    try:
-        await context.bot.pin_chat_message(
-            chat_id=update.effective_chat.id, message_id=pin_message.id
-        )
-    except telegram.error.BadRequest:
-        await pin_message.reply_text(
-            "📌 Pin this for quick access, or make me admin and run /pin@SplitLehBot again to pin automatically"
-        )
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat is None:
         return
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action=telegram.constants.ChatAction.TYPING,
-    )
+    if reply_inline(update, context, "Current operation cancelled."):
+        return
+
     await context.bot.send_message(
         chat_id=update.effective_chat.id, text="Current operation cancelled."
     )
@@ -253,10 +409,9 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat is None:
         return
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action=telegram.constants.ChatAction.TYPING,
-    )
+    if reply_inline(update, context, HELP_MESSAGE):
+        return
+
     await context.bot.send_message(chat_id=update.effective_chat.id, text=HELP_MESSAGE)
 
 
@@ -266,42 +421,22 @@ async def pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if env.MINI_APP_DEEPLINK is None:
         logger.error("[pin]: MINI_APP_DEEPLINK was not set, unable to send pin message")
+        if reply_inline(update, context, "Something went wrong, please try again."):
+            return
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Something went wrong, please try again.",
         )
         return
 
-    chat_context = {
-        "chat_id": update.effective_chat.id,
-        "chat_type": update.effective_chat.type,
-    }
-    chat_context_bytes = json.dumps(chat_context).encode("utf-8")
-    base64_encoded = base64.b64encode(chat_context_bytes).decode("utf-8")
-
-    url = env.MINI_APP_DEEPLINK.format(
-        botusername=context.bot.username, mode="compact", command=base64_encoded
-    )
-    inline_button = InlineKeyboardButton("💵 Expenses", url=url)
-    reply_markup = InlineKeyboardMarkup.from_button(inline_button)
-
-    pin_message = await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="🤑 Split your expense leh 🤑",
-        reply_markup=reply_markup,
-    )
-
-    try:
-        await context.bot.pin_chat_message(
-            chat_id=update.effective_chat.id, message_id=pin_message.id
-        )
-    except telegram.error.BadRequest:
-        await pin_message.reply_text(
-            "📌 Pin this for quick access, or make me admin and run /pin@SplitLehBot again to pin automatically"
-        )
+    # The pin message can not go inline, pinning it needs its message id
+    pin_message = await send_pin_message(update, context, "💵 Expenses")
+    context.application.create_task(try_pin(pin_message, context), update=update)
 
 
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update_deadline(update, context)
+
     if update.effective_chat is None:
         return
 
@@ -315,23 +450,47 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    user_list = ["Jarrett", "Sean", "Bubu", "Shawnn"]
-    balance_messages = []
-    for user in user_list:
-        deep_link_url = env.MINI_APP_DEEPLINK.format(
-            botusername=context.bot.username, command="group", mode="compact"
+    balances: Optional[BalanceStore] = context.bot_data.get("balances")
+    if balances is None:
+        return logger.error("[balance]: BalanceStore instance not found in bot_data")
+
+    async with typing_while_waiting(update, context):
+        group_balance = await balances.get(update.effective_chat.id, deadline=deadline)
+    if isinstance(group_balance, DeadlineExceeded):
+        logger.error("[balance] - balances.get: %s", group_balance)
+        return await context.bot.send_message(
+            chat_id=update.effective_chat.id, text=DEADLINE_EXCEEDED_MESSAGE
+        )
+    if isinstance(group_balance, Exception):
+        logger.error("[balance] - balances.get: %s", group_balance)
+        return await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="⚠️ Something went wrong fetching balances, please try again.",
         )
-        user_mention = helpers.mention_markdown(257256809, user, version=2)
-        user_message = (
-            f"🔵 *{user_mention}* • [🧾𝔹𝕣𝕖𝕒𝕜𝕕𝕠𝕨𝕟🧾]({deep_link_url})\n"
-            f"> Owes Bubu $10\n"
-            f"> Owes Shawnn $20\n"
+
+    balance_sheet = group_balance.balance_sheet()
+    names = group_balance.names
+    deep_link_url = mini_app_command_url(context.bot.username, "group")
+
+    balance_messages = []
+    for debtor_id, settlements in debts_by_debtor(balance_sheet.settlements).items():
+        user_mention = helpers.mention_markdown(
+            debtor_id, names.get(debtor_id, str(debtor_id)), version=2
         )
+        user_message = f"🔵 *{user_mention}* • [🧾𝔹𝕣𝕖𝕒𝕜𝕕𝕠𝕨𝕟🧾]({deep_link_url})\n"
+        for settlement in settlements:
+            creditor = names.get(settlement.creditor_id, str(settlement.creditor_id))
+            owes = f"Owes {creditor} ${settlement.amount / 100:,.2f}"
+            user_message += f"> {helpers.escape_markdown(owes, version=2)}\n"
 
         balance_messages.append(user_message)
 
     text = "*Current Balances*:\n\n"
-    text += "\n\n".join(balance_messages)
+    text += (
+        "\n\n".join(balance_messages)
+        if balance_messages
+        else helpers.escape_markdown("🎉 All settled up!", version=2)
+    )
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -341,27 +500,116 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def chase_summary(
+    message: telegram.Message,
+    context: ContextTypes.DEFAULT_TYPE,
+    reminders: Sequence[Tuple[ChaseTarget, str]],
+):
+    """Background job sending all reminders, then reporting back in one reply"""
+    outcomes = await remind_all(
+        context.bot, reminders, env.CHASE_CONCURRENCY, ParseMode.MARKDOWN_V2
+    )
+
+    logger.info(
+        "[chase] - reminded %s/%s users", len(outcomes["delivered"]), len(reminders)
+    )
+    await message.reply_text(
+        text=CHASE_SUMMARY_MESSAGE.format(
+            **{
+                outcome: (
+                    "\n".join(
+                        [
+                            f"> {telegram.helpers.escape_markdown(target.name, version=2)}"
+                            for target in targets
+                        ]
+                    )
+                    if targets
+                    else "> None"
+                )
+                for outcome, targets in outcomes.items()
+            }
+        ),
+        reply_markup=ReplyKeyboardRemove(),
+        parse_mode=ParseMode.MARKDOWN_V2,
+    )
+
+
 async def chase(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update_deadline(update, context)
+
     if update.effective_chat is None:
         return
 
     if update.message is None:
         return
 
+    # * In groups, chase every debtor from the group's balances in one go
+    # * ==================================================================
     if update.effective_chat.type != telegram.constants.ChatType.PRIVATE:
-        await update.message.reply_text(
-            text="⚠️ The 'chase' command is only available in your private chat with the bot"
+        balances: Optional[BalanceStore] = context.bot_data.get("balances")
+        if balances is None:
+            return logger.error("[chase]: BalanceStore instance not found in bot_data")
+
+        async with typing_while_waiting(update, context):
+            group_balance = await balances.get(
+                update.effective_chat.id, deadline=deadline
+            )
+        if isinstance(group_balance, Exception):
+            logger.error("[chase] - balances.get: %s", group_balance)
+            return await update.message.reply_text(
+                text=(
+                    DEADLINE_EXCEEDED_MESSAGE
+                    if isinstance(group_balance, DeadlineExceeded)
+                    else "⚠️ Something went wrong fetching balances, please try again."
+                )
+            )
+
+        names = group_balance.names
+        title = telegram.helpers.escape_markdown(
+            update.effective_chat.title or "", version=2
         )
+        reminders: List[Tuple[ChaseTarget, str]] = []
+        for debtor_id, settlements in debts_by_debtor(
+            group_balance.balance_sheet().settlements
+        ).items():
+            owes = "\n".join(
+                [
+                    "> "
+                    + telegram.helpers.escape_markdown(
+                        f"Owes {names.get(s.creditor_id, str(s.creditor_id))} ${s.amount / 100:,.2f}",
+                        version=2,
+                    )
+                    for s in settlements
+                ]
+            )
+            reminders.append(
+                (
+                    ChaseTarget(
+                        user_id=debtor_id, name=names.get(debtor_id, str(debtor_id))
+                    ),
+                    f"🤬💩REMINDER: FUCKING PAY BACK LEH\n\n{title}\n{owes}",
+                )
+            )
+
+        if not reminders:
+            return await update.message.reply_text(text="🎉 Nobody owes anything!")
+
+        context.application.create_task(
+            chase_summary(update.message, context, reminders), update=update
+        )
+        return
 
     button = KeyboardButtonRequestUsers(
-        request_id=0,
+        request_id=CHASE_USER_REQUEST,
         user_is_bot=False,
+        request_name=True,
         request_username=True,
+        max_quantity=telegram.constants.KeyboardButtonRequestUsersLimit.MAX_QUANTITY,
     )
 
     reply_markup = ReplyKeyboardMarkup.from_button(
         KeyboardButton(
-            text="Choose user",
+            text="Choose users",
             request_users=button,
         ),
         one_time_keyboard=True,
@@ -369,10 +617,12 @@ async def chase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     if update.message:
-        await update.message.reply_text(text="Select user", reply_markup=reply_markup)
+        await update.message.reply_text(text="Select users", reply_markup=reply_markup)
 
 
 async def user_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update_deadline(update, context)
+
     if update.message is None:
         return
 
@@ -395,19 +645,21 @@ async def user_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         api = cast(Api, context.bot_data.get("api"))
 
-        add_member_tasks = [
-            api.add_member(
-                AddMemberPayload(
-                    chat_id=int(group_id),
-                    user_id=user.user_id,
-                    first_name=user.first_name or "",
-                    last_name=user.last_name,
-                    username=user.username,
-                )
-            )
-            for user in users_shared.users
-        ]
-        results = await asyncio.gather(*add_member_tasks)
+        results = await api.add_members_bulk(
+            AddMembersBulkPayload(
+                chat_id=int(group_id),
+                members=[
+                    MemberPayload(
+                        user_id=user.user_id,
+                        first_name=user.first_name or "",
+                        last_name=user.last_name,
+                        username=user.username,
+                    )
+                    for user in users_shared.users
+                ],
+            ),
+            deadline=deadline,
+        )
 
         names = [user.first_name or str(user.user_id) for user in users_shared.users]
 
@@ -419,8 +671,8 @@ async def user_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 success.append(name)
 
-        logger.info(f"Added {', '.join(success)} to the group {group_id}")
-        logger.info(f"Failed to add {', '.join(failure)} to the group {group_id}")
+        logger.info("Added %s to the group %s", ", ".join(success), group_id)
+        logger.info("Failed to add %s to the group %s", ", ".join(failure), group_id)
 
         text = ADD_MEMBER_END_MESSAGE.format(
             member_list=(
@@ -454,31 +706,29 @@ async def user_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if users_shared.request_id == CHASE_USER_REQUEST:
         from_user = update.effective_sender
-        shared_user = users_shared.users[0]
-
-        try:
-            await context.bot.send_message(
-                shared_user.user_id,
-                f"🤬💩REMINDER: FUCKING PAY BACK {from_user.username} LEH",
-            )
-        except telegram.error.Forbidden:
-            await update.message.reply_text(
-                text=f"⚠️ Failed to send message to {shared_user.username} as it was blocked.",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-        except telegram.error.BadRequest:
-            await update.message.reply_text(
-                text=f"⚠️ Failed to send message to {shared_user.username} as they do not have conversation yet.",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-        else:
-            await update.message.reply_text(
-                f"✅ Successfully reminded {shared_user.username} to pay up!",
-                reply_markup=ReplyKeyboardRemove(),
+        text = telegram.helpers.escape_markdown(
+            f"🤬💩REMINDER: FUCKING PAY BACK {from_user.username} LEH", version=2
+        )
+        reminders = [
+            (
+                ChaseTarget(
+                    user_id=user.user_id,
+                    name=user.username or user.first_name or str(user.user_id),
+                ),
+                text,
             )
+            for user in users_shared.users
+        ]
+
+        # * Fan out in the background so the handler returns right away
+        context.application.create_task(
+            chase_summary(update.message, context, reminders), update=update
+        )
 
 
 async def bot_added(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update_deadline(update, context)
+
     if update.effective_chat is None:
         return
 
@@ -494,44 +744,40 @@ async def bot_added(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Check if the bot is in the new members
     bot = next(
-        filter(
-            lambda x: x.username == x.username == context.bot.username,
-            new_members,
-        )
+        filter(lambda x: x.id == context.bot.id, new_members),
+        None,
     )
 
     if bot is None:
         return
 
-    full_chat = await context.bot.get_chat(chat_id=update.effective_chat.id)
-
-    chat_photo_url: Optional[str] = None
-    if full_chat.photo is not None:
-        photo = await context.bot.get_file(full_chat.photo.big_file_id)
-        chat_photo_url = photo.file_path
-
-    api: Optional[Api] = context.bot_data.get("api")
-    if api is None:
-        return logger.error("[bot_added]: Api instance not found in bot_data")
+    bootstrap: Optional[GroupBootstrap] = context.bot_data.get("bootstrap")
+    if bootstrap is None:
+        return logger.error(
+            "[bot_added]: GroupBootstrap instance not found in bot_data"
+        )
 
-    payload = CreateChatPayload(
-        chat_id=update.effective_chat.id,
-        chat_title=update.effective_chat.title or f"Group:{update.effective_chat.id}",
-        chat_type=update.effective_chat.type,
-        chat_photo_url=chat_photo_url,
+    # * Greet right away, registration runs alongside and only edits the greeting on failure
+    greeting = asyncio.ensure_future(
+        update.message.reply_text(
+            text="🎉 Hello friends, I am here to help your split your expenses 💸!"
+        )
     )
-    api_result = await api.create_chat(payload)
-
-    if isinstance(api_result, Exception):
-        logger.error(f"[bot_added] - api.create_chat: {api_result}")
-        await update.message.reply_text(
+    api_result = await bootstrap.register(
+        context.bot, update.effective_chat, deadline=deadline
+    )
+    message = await greeting
+
+    if isinstance(api_result, DeadlineExceeded):
+        logger.error("[bot_added] - bootstrap.register: %s", api_result)
+        await message.edit_text(text=DEADLINE_EXCEEDED_MESSAGE)
+    elif isinstance(api_result, Exception):
+        logger.error("[bot_added] - bootstrap.register: %s", api_result)
+        await message.edit_text(
             text="⚠️ Failed to properly initialize the chat. Please try again by removing and re-adding the bot.",
         )
     else:
-        logger.info(f"Chat created: {api_result.message}")
-        await update.message.reply_text(
-            text="🎉 Hello friends, I am here to help your split your expenses 💸!"
-        )
+        logger.info("Chat registered: %s", api_result.message)
 
 
 async def add_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -582,6 +828,81 @@ async def add_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin only: sample the bot for a while and send back the collapsed stacks"""
+    if update.effective_chat is None or update.effective_user is None:
+        return
+
+    # * Unknown to everyone else, no answer
+    if update.effective_user.id not in env.ADMIN_USER_IDS:
+        return
+
+    profiler: Optional[SamplingProfiler] = context.bot_data.get("profiler")
+    if profiler is None:
+        return logger.error(
+            "[profile]: SamplingProfiler instance not found in bot_data"
+        )
+
+    if profiler.running:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id, text="🔬 A profile is already running."
+        )
+        return
+
+    duration = env.PROFILE_DURATION
+    if context.args:
+        try:
+            duration = max(float(context.args[0]), profiler.interval)
+        except ValueError:
+            pass
+    duration = min(duration, profiler.max_duration)
+
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id, text=f"🔬 Profiling for {duration:g}s..."
+    )
+    # * Sample in the background, the chat's later updates are not held up
+    context.application.create_task(
+        send_profile(update.effective_chat.id, context, profiler, duration),
+        update=update,
+    )
+
+
+async def send_profile(
+    chat_id: int,
+    context: ContextTypes.DEFAULT_TYPE,
+    profiler: SamplingProfiler,
+    duration: float,
+):
+    result = await profiler.profile(duration)
+    if result is None:
+        return
+
+    logger.info("[profile] - %s samples in %s", result.samples, result.path)
+    summary = "\n".join(
+        f"{handler}: {count / max(result.samples, 1):.1%}"
+        for handler, count in result.handlers.items()
+    )
+    caption = f"🔬 {result.samples} samples over {result.duration_s:.1f}s\n{summary}"
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=Path(result.path),
+        # * Captions are limited to 1024 characters
+        caption=caption[: telegram.constants.MessageLimit.CAPTION_LENGTH],
+    )
+
+
+async def profile_on_signal(profiler: SamplingProfiler):
+    result = await profiler.profile(env.PROFILE_DURATION)
+    if result is None:
+        return logger.warning("[profile] - a profile is already running")
+    logger.info(
+        "[profile] - %s samples in %s, per handler: %s",
+        result.samples,
+        result.path,
+        result.handlers,
+    )
+
+
 async def error(update: Optional[object], context: ContextTypes.DEFAULT_TYPE):
     """Log the error and send a formatted message to the user/developer."""
 
@@ -592,56 +913,221 @@ async def error(update: Optional[object], context: ContextTypes.DEFAULT_TYPE):
     logger.error("[error]: Exception while handling an update:", exc_info=context.error)
 
 
-async def post_init(application: Application):
+async def sync_bot_commands(bot: telegram.Bot):
+    # * Set commands for the bot, only when they changed since they were last set
+    if await sync_commands(bot, env.COMMANDS_HASH_PATH):
+        logger.info("Bot commands updated")
 
-    # * Set commands for the bot
-    # *=============================================================================================
 
-    # Commands for all chats
-    common_commands = [
-        BotCommand("start", "Start the bot"),
-        BotCommand("help", "Find out how to use the bot"),
-        BotCommand("pin", "Pin the expenses mini-app"),
-    ]
+async def post_init(application: Application):
+    # * Workers behind a front receiver leave the commands to it
+    if application.bot_data.get("worker") is None:
+        await sync_bot_commands(application.bot)
 
-    # Commands for private chats
-    private_commands = [
-        *common_commands,
-        BotCommand("chase", "Chase someone for payment"),
-    ]
-    await application.bot.set_my_commands(
-        private_commands, scope=BotCommandScopeAllPrivateChats()
+    # * Set Api instance to the context
+    api = Api()
+    application.bot_data["api"] = api
+    # * Per group balances, kept current from the backend expense change feed
+    application.bot_data["balances"] = BalanceStore(api)
+    # * Registered user ids, warmed from the backend in the background
+    known_users = KnownUsers(
+        api, env.KNOWN_USERS_PATH or None, refresh_interval=env.KNOWN_USERS_REFRESH
     )
-
-    # Commands for group chats
-    group_commands = [
-        *common_commands,
-        BotCommand("balance", "View current split balances"),
-    ]
-    await application.bot.set_my_commands(
-        group_commands, scope=BotCommandScopeAllGroupChats()
+    await known_users.start()
+    application.bot_data["known_users"] = known_users
+    # * Registers groups the bot is added to, caching Telegram metadata and registrations
+    application.bot_data["bootstrap"] = GroupBootstrap(
+        api,
+        metadata_ttl=env.CHAT_METADATA_TTL,
+        registration_ttl=env.CHAT_REGISTRATION_TTL,
     )
-    # *=============================================================================================
 
-    # * Set Api instance to the context
-    application.bot_data["api"] = Api()
+    # * Sampling profiler, off until an admin's /profile or SIGUSR1 starts it
+    profiler = SamplingProfiler(
+        handler_codes(application),
+        env.PROFILE_DIR,
+        interval=env.PROFILE_INTERVAL,
+        max_duration=env.PROFILE_MAX_DURATION,
+    )
+    application.bot_data["profiler"] = profiler
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1,
+                lambda: application.create_task(profile_on_signal(profiler)),
+            )
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning("[profile] - SIGUSR1 not available: %s", e)
+
+    # * Serve metrics next to the webhook listener
+    if metrics.enabled:
+        register_stats_metrics(application)
+        server = metrics.MetricsServer("0.0.0.0", application.bot_data["metrics_port"])
+        await server.start()
+        application.bot_data["metrics_server"] = server
+
+
+def register_stats_metrics(application: Application):
+    """Expose the counters the components already keep next to the timings"""
+    api: Api = application.bot_data["api"]
+    scheduler = cast(UpdateScheduler, application.update_processor)
+    rate_limiter = cast(PriorityRateLimiter, application.bot.rate_limiter)
+    dedup: Deduplicator = application.bot_data["dedup"]
+    known_users: KnownUsers = application.bot_data["known_users"]
+
+    for metric in (
+        metrics.Collected(
+            "api_user_cache_lookups_total",
+            "User cache lookups by result",
+            "counter",
+            lambda: [
+                ({"result": "hit"}, api.user_cache.hits),
+                ({"result": "miss"}, api.user_cache.misses),
+            ],
+        ),
+        metrics.Collected(
+            "known_users_lookups_total",
+            "Known user lookups by result, uncertain ones fall back to the backend",
+            "counter",
+            lambda: [
+                ({"result": "known"}, known_users.known),
+                ({"result": "unknown"}, known_users.unknown),
+                ({"result": "uncertain"}, known_users.uncertain),
+            ],
+        ),
+        metrics.Collected(
+            "api_pool_connections",
+            "Backend connections by state",
+            "gauge",
+            lambda: [
+                ({"state": "in_use"}, api.pool_stats().in_use),
+                ({"state": "idle"}, api.pool_stats().idle),
+            ],
+        ),
+        metrics.Collected(
+            "api_circuit_open",
+            "1 while the endpoint's circuit breaker is open",
+            "gauge",
+            lambda: [
+                ({"endpoint": endpoint}, float(stats.state == "open"))
+                for endpoint, stats in api.resilience_stats().items()
+            ],
+        ),
+        metrics.Collected(
+            "telegram_outbound_queue_depth",
+            "Bot API calls waiting for the global budget",
+            "gauge",
+            lambda: [({}, rate_limiter.stats().queue_depth)],
+        ),
+        metrics.Collected(
+            "telegram_retry_after_total",
+            "Flood control responses from the Bot API",
+            "counter",
+            lambda: [({}, rate_limiter.retry_afters)],
+        ),
+        metrics.Collected(
+            "updates_duplicate_total",
+            "Redelivered updates dropped before any handler ran",
+            "counter",
+            lambda: [({}, dedup.duplicates)],
+        ),
+        metrics.Collected(
+            "log_records_dropped_total",
+            "Log records not written, by reason",
+            "counter",
+            lambda: [
+                ({"reason": "queue_full"}, logs.stats().dropped),
+                ({"reason": "rate_limited"}, logs.stats().suppressed),
+            ],
+        ),
+        metrics.Collected(
+            "update_scheduler_updates",
+            "Admitted updates by state",
+            "gauge",
+            lambda: [
+                ({"state": "running"}, scheduler.active),
+                ({"state": "waiting"}, scheduler.backlog - scheduler.active),
+            ],
+        ),
+    ):
+        metrics.registry.register(metric)
 
 
 async def post_shutdown(application: Application):
+    # * Stop serving metrics
+    server: Optional[metrics.MetricsServer] = application.bot_data.get("metrics_server")
+    if server is not None:
+        await server.stop()
+
+    # * Save the known users for the next start
+    known_users: Optional[KnownUsers] = application.bot_data.get("known_users")
+    if known_users is not None:
+        await known_users.stop()
+
     # * Clean up the API session
     api: Api = application.bot_data.get("api")
     if api is not None:
         await api.clean_up()
 
-
-def main():
-    application = (
+    dedup: Optional[Deduplicator] = application.bot_data.get("dedup")
+    if dedup is not None:
+        dedup.close()
+
+
+def persistence_path(worker: Optional[int]) -> str:
+    """Each worker caches and flushes its own user_data, so each gets a file of its
+    own. A user's private chat always lands on the same worker."""
+    if worker is None:
+        return env.PERSISTENCE_PATH
+    root, extension = os.path.splitext(env.PERSISTENCE_PATH)
+    return f"{root}.worker{worker}{extension}"
+
+
+def build_application(
+    workers: int = 1,
+    metrics_port: int = env.METRICS_PORT,
+    worker: Optional[int] = None,
+) -> Tuple[Application, PriorityRateLimiter]:
+    metrics.enabled = env.METRICS_ENABLED
+    rate_limiter = PriorityRateLimiter(
+        # * Workers share the bot's global budget, chats are never split across workers
+        overall_max_rate=env.TELEGRAM_GLOBAL_RATE_LIMIT / workers,
+        group_max_rate=env.TELEGRAM_GROUP_RATE_LIMIT,
+        private_max_rate=env.TELEGRAM_PRIVATE_RATE_LIMIT,
+        max_retries=env.TELEGRAM_MAX_RETRIES,
+    )
+    builder = (
         ApplicationBuilder()
         .token(env.TELEGRAM_BOT_TOKEN)
+        .base_url(env.TELEGRAM_API_BASE_URL)
         .post_init(post_init)
-        .concurrent_updates(True)
-        .build()
+        .post_shutdown(post_shutdown)
+        # * Chats in order and in parallel, with a bounded backlog pushing back on intake
+        .concurrent_updates(
+            UpdateScheduler(
+                max_concurrent=env.UPDATE_CONCURRENCY,
+                max_backlog=env.UPDATE_MAX_BACKLOG,
+            )
+        )
+        .update_queue(asyncio.Queue(maxsize=env.UPDATE_MAX_BACKLOG))
+        .rate_limiter(rate_limiter)
     )
+    if env.PERSISTENCE_PATH:
+        from persistence import SqliteStore, WriteBehindPersistence
+
+        # * Keeps user state such as an add member flow in progress across restarts
+        builder = builder.persistence(
+            WriteBehindPersistence(
+                SqliteStore(persistence_path(worker)),
+                flush_interval=env.PERSISTENCE_FLUSH_INTERVAL,
+                # bot_data holds live clients, nothing else but user_data is used
+                store_data=PersistenceInput(
+                    bot_data=False, chat_data=False, callback_data=False
+                ),
+                update_interval=env.PERSISTENCE_FLUSH_INTERVAL,
+            )
+        )
+    application = builder.build()
 
     # Define handlers
     start_handler = CommandHandler("start", start)
@@ -655,6 +1141,7 @@ def main():
     )
     bot_added_handler = MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, bot_added)
     balance_handler = CommandHandler("balance", balance)
+    profile_handler = CommandHandler("profile", profile)
     add_member_handler = CommandHandler(
         "start", add_member, filters.Regex(ADD_MEMBER_COMMAND)
     )
@@ -668,11 +1155,53 @@ def main():
     application.add_handler(bot_added_handler)
     application.add_handler(add_member_handler)
     application.add_handler(cancel_handler)
+    application.add_handler(profile_handler)
     application.add_handler(start_handler)
 
+    # * Drop updates Telegram delivers again, before any handler runs
+    Deduplicator(
+        SeenUpdates(window=env.UPDATE_DEDUP_WINDOW, max_size=env.UPDATE_DEDUP_MAX_SIZE),
+        shared=(
+            SqliteSeenStore(env.PERSISTENCE_PATH, window=env.UPDATE_DEDUP_WINDOW)
+            if env.UPDATE_DEDUP_SHARED and env.PERSISTENCE_PATH
+            else None
+        ),
+    ).register(application)
+
     # Special handler for general errors
     application.add_error_handler(error)
 
+    # * Handler timings, the callbacks are left untouched while metrics are off
+    metrics.instrument_handlers(application)
+    application.bot_data["metrics_port"] = metrics_port
+    application.bot_data["worker"] = worker
+
+    return application, rate_limiter
+
+
+def run_worker(port: int, workers: int):
+    """One webhook worker behind the front receiver, with its own Api session and caches"""
+    from webhook import InlineReplies, run_webhook
+
+    # * Each worker serves its own metrics, on the ports following METRICS_PORT
+    index = port - env.WEBHOOK_WORKER_BASE_PORT
+    application, rate_limiter = build_application(
+        workers, env.METRICS_PORT + 1 + index, worker=index
+    )
+    replies = InlineReplies(rate_limiter, inline=env.TELEGRAM_WEBHOOK_REPLY)
+    replies.register(application)
+    run_webhook(
+        application,
+        replies,
+        listen="127.0.0.1",
+        port=port,
+        webhook_url=None,
+        secret_token=os.environ.get("TELEGRAM_WEBHOOK_SECRET", "NotSoSecret"),
+        reply_wait=env.TELEGRAM_WEBHOOK_REPLY_WAIT,
+    )
+
+
+def main():
     # Run the bot in polling mode or webhook mode depending on the environment
     if env.ENV == "production":
         # Ensure the TELEGRAM_WEBHOOK_URL is set in the environment variables
@@ -683,7 +1212,43 @@ def main():
 
         # * Run the bot in production mode with webhook enabled
         logger.info("Running in production mode, with webhook enabled.")
-        logger.info(f"Webhook URL: {TELEGRAM_WEBHOOK_URL}")
+        logger.info("Webhook URL: %s", TELEGRAM_WEBHOOK_URL)
+        if env.WEBHOOK_WORKERS > 1:
+            from sharding import run_sharded
+
+            # * Updates are sharded by chat over worker processes
+            run_sharded(
+                run_worker,
+                workers=env.WEBHOOK_WORKERS,
+                listen="0.0.0.0",
+                port=int(os.environ.get("PORT", 8443)),
+                worker_base_port=env.WEBHOOK_WORKER_BASE_PORT,
+                webhook_url=TELEGRAM_WEBHOOK_URL,
+                bot_token=env.TELEGRAM_BOT_TOKEN,
+                secret_token=os.environ.get("TELEGRAM_WEBHOOK_SECRET", "NotSoSecret"),
+                bot_base_url=env.TELEGRAM_API_BASE_URL,
+                setup_bot=sync_bot_commands,
+            )
+            return
+
+        application, rate_limiter = build_application()
+        if env.TELEGRAM_WEBHOOK_REPLY:
+            from webhook import InlineReplies, run_webhook
+
+            # * Simple handlers answer inline in the webhook response
+            replies = InlineReplies(rate_limiter)
+            replies.register(application)
+            run_webhook(
+                application,
+                replies,
+                listen="0.0.0.0",
+                port=int(os.environ.get("PORT", 8443)),
+                webhook_url=TELEGRAM_WEBHOOK_URL,
+                secret_token=os.environ.get("TELEGRAM_WEBHOOK_SECRET", "NotSoSecret"),
+                reply_wait=env.TELEGRAM_WEBHOOK_REPLY_WAIT,
+            )
+            return
+
         application.run_webhook(
             listen="0.0.0.0",
             port=int(os.environ.get("PORT", 8443)),
@@ -693,6 +1258,7 @@ def main():
     else:
         # * Run the bot in development mode with polling enabled
         logger.info("Running in development mode, with polling enabled.")
+        application, _ = build_application()
         application.run_polling()
 
 
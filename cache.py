@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+from pydantic import BaseModel
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded in-process cache with per-entry TTL and LRU eviction.
+
+    Not thread-safe, it is meant to be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_size <= 0:
+            raise ValueError(f"Invalid max_size: {max_size}, must be positive")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        # * key -> (expires_at, value), ordered from least to most recently used
+        self._entries: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None):
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: K):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self._entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, List, Literal, Optional, Sequence, Tuple
+import telegram
+from pydantic import BaseModel
+from rate_limiter import Priority
+
+ChaseOutcome = Literal["delivered", "blocked", "no_conversation", "failed"]
+
+
+class ChaseTarget(BaseModel):
+    user_id: int
+    name: str
+
+
+async def remind(
+    bot: telegram.Bot, target: ChaseTarget, text: str, parse_mode: Optional[str] = None
+) -> Tuple[ChaseTarget, ChaseOutcome]:
+    try:
+        await bot.send_message(
+            target.user_id,
+            text,
+            parse_mode=parse_mode,
+            rate_limit_args=Priority.REMINDER,
+        )
+    except telegram.error.Forbidden:
+        return target, "blocked"
+    except telegram.error.BadRequest:
+        return target, "no_conversation"
+    except telegram.error.TelegramError:
+        return target, "failed"
+    return target, "delivered"
+
+
+async def remind_all(
+    bot: telegram.Bot,
+    reminders: Sequence[Tuple[ChaseTarget, str]],
+    concurrency: int,
+    parse_mode: Optional[str] = None,
+) -> Dict[ChaseOutcome, List[ChaseTarget]]:
+    """Send every reminder with at most `concurrency` in flight, pacing is left to
+    the bot's rate limiter. Returns the targets grouped by outcome."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def remind_one(target: ChaseTarget, text: str):
+        async with semaphore:
+            return await remind(bot, target, text, parse_mode)
+
+    outcomes: Dict[ChaseOutcome, List[ChaseTarget]] = {
+        "delivered": [],
+        "blocked": [],
+        "no_conversation": [],
+        "failed": [],
+    }
+    results = await asyncio.gather(
+        *[remind_one(target, text) for target, text in reminders]
+    )
+    for target, outcome in results:
+        outcomes[outcome].append(target)
+    return outcomes
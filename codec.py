@@ -0,0 +1,35 @@
+# * JSON codec for the Api session, preferring orjson or msgspec when installed
+
+import json
+from typing import Any, Callable, Union
+
+dumps: Callable[[Any], str]
+loads: Callable[[Union[bytes, str]], Any]
+
+try:
+    import orjson
+
+    NAME = "orjson"
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    loads = orjson.loads
+
+except ImportError:
+    try:
+        import msgspec
+
+        NAME = "msgspec"
+        _encoder = msgspec.json.Encoder()
+        _decoder = msgspec.json.Decoder()
+
+        def dumps(obj: Any) -> str:
+            return _encoder.encode(obj).decode("utf-8")
+
+        loads = _decoder.decode
+
+    except ImportError:
+        NAME = "json"
+        dumps = json.dumps
+        loads = json.loads
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import os
+from typing import List, Tuple
+from telegram import (
+    Bot,
+    BotCommand,
+    BotCommandScope,
+    BotCommandScopeAllGroupChats,
+    BotCommandScopeAllPrivateChats,
+)
+import codec
+
+logger = logging.getLogger(__name__)
+
+# Commands for all chats
+COMMON_COMMANDS = [
+    BotCommand("start", "Start the bot"),
+    BotCommand("help", "Find out how to use the bot"),
+    BotCommand("pin", "Pin the expenses mini-app"),
+]
+
+# Commands for private chats
+PRIVATE_COMMANDS = [
+    *COMMON_COMMANDS,
+    BotCommand("chase", "Chase someone for payment"),
+]
+
+# Commands for group chats
+GROUP_COMMANDS = [
+    *COMMON_COMMANDS,
+    BotCommand("balance", "View current split balances"),
+    BotCommand("chase", "Remind everyone who owes money"),
+]
+
+COMMAND_SETS: List[Tuple[BotCommandScope, List[BotCommand]]] = [
+    (BotCommandScopeAllPrivateChats(), PRIVATE_COMMANDS),
+    (BotCommandScopeAllGroupChats(), GROUP_COMMANDS),
+]
+
+
+def commands_hash(bot_id: int) -> str:
+    """Hash of every command set, for the bot it is set on"""
+    command_sets = [
+        [scope.to_dict(), [command.to_dict() for command in commands]]
+        for scope, commands in COMMAND_SETS
+    ]
+    return hashlib.sha256(codec.dumps([bot_id, command_sets]).encode()).hexdigest()
+
+
+async def sync_commands(bot: Bot, hash_path: str) -> bool:
+    """Set the commands unless the hash stored at `hash_path` shows they already
+    are, returns whether they were set"""
+    current = commands_hash(bot.id)
+    try:
+        with open(hash_path) as file:
+            if file.read().strip() == current:
+                return False
+    except OSError:
+        pass
+
+    for scope, commands in COMMAND_SETS:
+        await bot.set_my_commands(commands, scope=scope)
+
+    try:
+        # Replace atomically, several workers may sync at the same time
+        temporary_path = f"{hash_path}.{os.getpid()}"
+        with open(temporary_path, "w") as file:
+            file.write(current)
+        os.replace(temporary_path, hash_path)
+    except OSError as e:
+        logger.warning("[commands] - unable to store the commands hash: %s", e)
+    return True
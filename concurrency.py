@@ -0,0 +1,49 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class SingleFlightStats(BaseModel):
+    in_flight: int
+    calls: int
+    coalesced: int
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls sharing the same key into one execution.
+
+    The first caller for a key starts the work, every caller arriving while it
+    is still in flight awaits the same future. A caller being cancelled does not
+    cancel the shared work for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, "asyncio.Future[T]"] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: "asyncio.Future[T]"):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(
+            in_flight=len(self._in_flight),
+            calls=self.calls,
+            coalesced=self.coalesced,
+        )
@@ -0,0 +1,35 @@
+import math
+import time
+from typing import Callable, Optional
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, operation: str):
+        super().__init__(f"Deadline exceeded during {operation}")
+        self.operation = operation
+
+
+class Deadline:
+    """Time budget for handling a single update, passed down into Api calls"""
+
+    def __init__(
+        self,
+        budget: float,
+        clock: Callable[[], float] = time.monotonic,
+        started_at: Optional[float] = None,
+    ):
+        """`started_at` is a `clock` time the budget counts from, defaults to now"""
+        self._clock = clock
+        self.budget = budget
+        self.expires_at = (clock() if started_at is None else started_at) + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def extend(self, other: Optional["Deadline"]):
+        """Push the expiry out to `other`'s if it is later, None for no deadline"""
+        expires_at = math.inf if other is None else other.expires_at
+        self.expires_at = max(self.expires_at, expires_at)
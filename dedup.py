@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Optional, Set, Tuple
+from pydantic import BaseModel
+from telegram import Update
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    ContextTypes,
+    TypeHandler,
+)
+
+logger = logging.getLogger(__name__)
+
+# * Handler group running before all others, duplicates never reach a handler
+DEDUP_GROUP = -1_000
+
+
+class SeenUpdates:
+    """Update ids seen in the last `window` seconds, at most `max_size` of them.
+
+    Ids are kept in generations spanning a fraction of the window: the current one
+    in a set, older ones frozen into sorted arrays of 8 bytes per id, looked up by
+    bisection. Whole generations expire at once.
+    """
+
+    def __init__(
+        self, window: float = 3600, max_size: int = 100_000, generations: int = 8
+    ):
+        self.window = window
+        self.max_size = max_size
+        # * A generation is frozen after its span or once it holds its share of ids
+        self._span = window / generations
+        self._generation_size = max(1, max_size // generations)
+        self._current: Set[int] = set()
+        self._started = self._last = time.monotonic()
+        # * Frozen generations, oldest first, with the time of their last id
+        self._frozen: Deque[Tuple[float, "array[int]"]] = deque()
+        self._frozen_size = 0
+
+    def __len__(self) -> int:
+        return len(self._current) + self._frozen_size
+
+    def add(self, update_id: int) -> bool:
+        """Mark the id as seen, returns whether it already was"""
+        now = time.monotonic()
+        if now - self._started >= self._span:
+            self._freeze(now)
+        while self._frozen and now - self._frozen[0][0] > self.window:
+            self._frozen_size -= len(self._frozen.popleft()[1])
+
+        if update_id in self._current or self._in_frozen(update_id):
+            return True
+
+        self._current.add(update_id)
+        self._last = now
+        if len(self._current) >= self._generation_size:
+            self._freeze(now)
+        while len(self) > self.max_size and self._frozen:
+            self._frozen_size -= len(self._frozen.popleft()[1])
+        return False
+
+    def _freeze(self, now: float):
+        if self._current:
+            self._frozen.append((self._last, array("q", sorted(self._current))))
+            self._frozen_size += len(self._current)
+            self._current = set()
+        self._started = now
+
+    def _in_frozen(self, update_id: int) -> bool:
+        for _, ids in self._frozen:
+            index = bisect_left(ids, update_id)
+            if index < len(ids) and ids[index] == update_id:
+                return True
+        return False
+
+
+class SqliteSeenStore:
+    """Update ids claimed by any process sharing the SQLite file, e.g. the
+    persistence file, so replicas on one host drop each other's duplicates"""
+
+    def __init__(self, path: str, window: float = 3600, prune_every: int = 1_000):
+        self.path = path
+        self.window = window
+        self.prune_every = prune_every
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._claims = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen_updates ("
+                "update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def claim(self, update_id: int) -> bool:
+        """Record the id, returns False when another process already had. Blocking."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            claimed = connection.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)",
+                (update_id, now),
+            ).rowcount
+            self._claims += 1
+            if self._claims % self.prune_every == 0:
+                connection.execute(
+                    "DELETE FROM seen_updates WHERE seen_at < ?", (now - self.window,)
+                )
+        return claimed == 1
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class DedupStats(BaseModel):
+    checked: int
+    duplicates: int
+    tracked: int
+    shared_errors: int
+
+
+class Deduplicator:
+    """Drops updates whose update_id was already seen, e.g. a webhook update
+    Telegram delivered again because the first delivery was answered too slowly.
+
+    Runs as a handler ahead of all others, so it covers every way of receiving
+    updates. With a `shared` store, ids are also claimed there, after the local
+    set missed.
+    """
+
+    def __init__(self, seen: SeenUpdates, shared: Optional[SqliteSeenStore] = None):
+        self.seen = seen
+        self.shared = shared
+        self.checked = 0
+        self.duplicates = 0
+        self.shared_errors = 0
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        self.checked += 1
+        if self.seen.add(update_id):
+            self.duplicates += 1
+            return True
+        if self.shared is None:
+            return False
+
+        try:
+            claimed = await asyncio.to_thread(self.shared.claim, update_id)
+        except sqlite3.Error as e:
+            # * Handling it twice is better than not at all
+            self.shared_errors += 1
+            logger.warning("[dedup] - shared claim of %s failed: %s", update_id, e)
+            return False
+        if not claimed:
+            self.duplicates += 1
+        return not claimed
+
+    async def check(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        if not isinstance(update, Update):
+            return
+        if not await self.is_duplicate(update.update_id):
+            return
+
+        logger.info("[dedup] - dropped duplicate update %s", update.update_id)
+        # * Release a webhook response held open for the duplicate
+        replies = context.bot_data.get("inline_replies")
+        if replies is not None:
+            await replies.finished(update, context)
+        raise ApplicationHandlerStop
+
+    def register(self, application: Application):
+        application.bot_data["dedup"] = self
+        application.add_handler(TypeHandler(Update, self.check), group=DEDUP_GROUP)
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+    def stats(self) -> DedupStats:
+        return DedupStats(
+            checked=self.checked,
+            duplicates=self.duplicates,
+            tracked=len(self.seen),
+            shared_errors=self.shared_errors,
+        )
@@ -0,0 +1,44 @@
+import base64
+import functools
+import json
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from env import env
+
+# * Bounded memo size, one entry per (chat, mode, button text) combination
+DEEPLINK_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=DEEPLINK_CACHE_SIZE)
+def mini_app_url(
+    bot_username: str, chat_id: int, chat_type: str, mode: str = "compact"
+) -> str:
+    """Mini app deep link carrying the base64 encoded chat context"""
+    chat_context = {"chat_id": chat_id, "chat_type": chat_type}
+    chat_context_bytes = json.dumps(chat_context).encode("utf-8")
+    base64_encoded = base64.b64encode(chat_context_bytes).decode("utf-8")
+
+    return env.MINI_APP_DEEPLINK.format(
+        botusername=bot_username, mode=mode, command=base64_encoded
+    )
+
+
+@functools.lru_cache(maxsize=DEEPLINK_CACHE_SIZE)
+def mini_app_markup(
+    bot_username: str,
+    chat_id: int,
+    chat_type: str,
+    text: str,
+    mode: str = "compact",
+) -> InlineKeyboardMarkup:
+    """Single button markup opening the mini app for the chat, safe to share
+    since telegram objects are immutable"""
+    url = mini_app_url(bot_username, chat_id, chat_type, mode)
+    return InlineKeyboardMarkup.from_button(InlineKeyboardButton(text, url=url))
+
+
+@functools.lru_cache(maxsize=DEEPLINK_CACHE_SIZE)
+def mini_app_command_url(bot_username: str, command: str, mode: str = "compact") -> str:
+    """Mini app deep link for a plain command without chat context"""
+    return env.MINI_APP_DEEPLINK.format(
+        botusername=bot_username, mode=mode, command=command
+    )
@@ -1,5 +1,5 @@
 from pprint import pprint
-from typing import Literal, cast
+from typing import List, Literal, cast
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import os
@@ -13,6 +13,57 @@ class Env(BaseModel):
     MINI_APP_DEEPLINK: str
     API_BASE_URL: str
     API_KEY: str
+    API_USER_CACHE_TTL: float = Field(default=300)
+    API_USER_CACHE_NEGATIVE_TTL: float = Field(default=5)
+    API_USER_CACHE_MAX_SIZE: int = Field(default=10_000)
+    API_ADD_MEMBERS_CONCURRENCY: int = Field(default=5)
+    API_BULK_REPROBE_INTERVAL: float = Field(default=600)
+    API_POOL_LIMIT: int = Field(default=100)
+    API_POOL_LIMIT_PER_HOST: int = Field(default=30)
+    API_KEEPALIVE_TIMEOUT: float = Field(default=30)
+    API_DNS_CACHE_TTL: int = Field(default=300)
+    API_CONNECT_TIMEOUT: float = Field(default=5)
+    API_TOTAL_TIMEOUT: float = Field(default=30)
+    API_RETRY_MAX_ATTEMPTS: int = Field(default=3)
+    API_RETRY_BASE_DELAY: float = Field(default=0.2)
+    API_RETRY_MAX_DELAY: float = Field(default=2)
+    API_BREAKER_FAILURE_THRESHOLD: int = Field(default=5)
+    API_BREAKER_RESET_TIMEOUT: float = Field(default=30)
+    API_BREAKER_HALF_OPEN_PROBES: int = Field(default=1)
+    UPDATE_DEADLINE: float = Field(default=10)
+    TELEGRAM_GLOBAL_RATE_LIMIT: float = Field(default=30)
+    TELEGRAM_GROUP_RATE_LIMIT: float = Field(default=20)
+    TELEGRAM_PRIVATE_RATE_LIMIT: float = Field(default=1)
+    TELEGRAM_MAX_RETRIES: int = Field(default=3)
+    CHASE_CONCURRENCY: int = Field(default=10)
+    CHAT_METADATA_TTL: float = Field(default=300)
+    CHAT_REGISTRATION_TTL: float = Field(default=3600)
+    TELEGRAM_WEBHOOK_REPLY: bool = Field(default=False)
+    TELEGRAM_WEBHOOK_REPLY_WAIT: float = Field(default=1)
+    PERSISTENCE_PATH: str = Field(default="")
+    PERSISTENCE_FLUSH_INTERVAL: float = Field(default=1)
+    WEBHOOK_WORKERS: int = Field(default=1)
+    WEBHOOK_WORKER_BASE_PORT: int = Field(default=9001)
+    UPDATE_CONCURRENCY: int = Field(default=64)
+    UPDATE_MAX_BACKLOG: int = Field(default=1000)
+    COMMANDS_HASH_PATH: str = Field(default="split-leh.commands")
+    TELEGRAM_API_BASE_URL: str = Field(default="https://api.telegram.org/bot")
+    METRICS_ENABLED: bool = Field(default=False)
+    METRICS_PORT: int = Field(default=9090)
+    ADMIN_USER_IDS: List[int] = Field(default_factory=list)
+    PROFILE_DIR: str = Field(default="profiles")
+    PROFILE_INTERVAL: float = Field(default=0.005)
+    PROFILE_DURATION: float = Field(default=30)
+    PROFILE_MAX_DURATION: float = Field(default=120)
+    LOG_LEVEL: str = Field(default="INFO")
+    LOG_FORMAT: Literal["json", "text"] = Field(default="json")
+    LOG_RATE_LIMIT: float = Field(default=20)
+    LOG_QUEUE_SIZE: int = Field(default=10_000)
+    UPDATE_DEDUP_WINDOW: float = Field(default=3600)
+    UPDATE_DEDUP_MAX_SIZE: int = Field(default=100_000)
+    UPDATE_DEDUP_SHARED: bool = Field(default=False)
+    KNOWN_USERS_PATH: str = Field(default="")
+    KNOWN_USERS_REFRESH: float = Field(default=3600)
 
 
 # * RUNTIME ENVIRONMENT
@@ -55,6 +106,101 @@ if not _MINI_APP_DEEPLINK:
         "Environment variables not complete: MINI_APP_DEEPLINK is required"
     )
 
+# * USER CACHE IN FRONT OF THE API SERVICE (ttl in seconds)
+_API_USER_CACHE_TTL = os.environ.get("API_USER_CACHE_TTL", "300")
+_API_USER_CACHE_NEGATIVE_TTL = os.environ.get("API_USER_CACHE_NEGATIVE_TTL", "5")
+_API_USER_CACHE_MAX_SIZE = os.environ.get("API_USER_CACHE_MAX_SIZE", "10000")
+
+# * MAX CONCURRENT REQUESTS WHEN ADDING MEMBERS ONE BY ONE
+_API_ADD_MEMBERS_CONCURRENCY = os.environ.get("API_ADD_MEMBERS_CONCURRENCY", "5")
+
+# * SECONDS BEFORE TRYING THE BULK MEMBERS ENDPOINT AGAIN AFTER THE BACKEND REJECTED IT
+_API_BULK_REPROBE_INTERVAL = os.environ.get("API_BULK_REPROBE_INTERVAL", "600")
+
+# * CONNECTION POOL FOR THE API SERVICE SESSION (timeouts in seconds, 0 = unlimited pool)
+_API_POOL_LIMIT = os.environ.get("API_POOL_LIMIT", "100")
+_API_POOL_LIMIT_PER_HOST = os.environ.get("API_POOL_LIMIT_PER_HOST", "30")
+_API_KEEPALIVE_TIMEOUT = os.environ.get("API_KEEPALIVE_TIMEOUT", "30")
+_API_DNS_CACHE_TTL = os.environ.get("API_DNS_CACHE_TTL", "300")
+_API_CONNECT_TIMEOUT = os.environ.get("API_CONNECT_TIMEOUT", "5")
+_API_TOTAL_TIMEOUT = os.environ.get("API_TOTAL_TIMEOUT", "30")
+
+# * RETRIES (idempotent calls only) AND CIRCUIT BREAKER FOR THE API SERVICE (seconds)
+_API_RETRY_MAX_ATTEMPTS = os.environ.get("API_RETRY_MAX_ATTEMPTS", "3")
+_API_RETRY_BASE_DELAY = os.environ.get("API_RETRY_BASE_DELAY", "0.2")
+_API_RETRY_MAX_DELAY = os.environ.get("API_RETRY_MAX_DELAY", "2")
+_API_BREAKER_FAILURE_THRESHOLD = os.environ.get("API_BREAKER_FAILURE_THRESHOLD", "5")
+_API_BREAKER_RESET_TIMEOUT = os.environ.get("API_BREAKER_RESET_TIMEOUT", "30")
+_API_BREAKER_HALF_OPEN_PROBES = os.environ.get("API_BREAKER_HALF_OPEN_PROBES", "1")
+
+# * TIME BUDGET (seconds) FOR HANDLING ONE UPDATE, BOUNDS ALL API CALLS IT MAKES
+_UPDATE_DEADLINE = os.environ.get("UPDATE_DEADLINE", "10")
+
+# * OUTBOUND TELEGRAM BUDGETS: GLOBAL AND PRIVATE PER SECOND, GROUP PER MINUTE
+_TELEGRAM_GLOBAL_RATE_LIMIT = os.environ.get("TELEGRAM_GLOBAL_RATE_LIMIT", "30")
+_TELEGRAM_GROUP_RATE_LIMIT = os.environ.get("TELEGRAM_GROUP_RATE_LIMIT", "20")
+_TELEGRAM_PRIVATE_RATE_LIMIT = os.environ.get("TELEGRAM_PRIVATE_RATE_LIMIT", "1")
+_TELEGRAM_MAX_RETRIES = os.environ.get("TELEGRAM_MAX_RETRIES", "3")
+
+# * MAX REMINDERS IN FLIGHT FOR A BULK /chase
+_CHASE_CONCURRENCY = os.environ.get("CHASE_CONCURRENCY", "10")
+
+# * GROUP BOOTSTRAP CACHES: TELEGRAM CHAT METADATA AND BACKEND REGISTRATIONS (seconds)
+_CHAT_METADATA_TTL = os.environ.get("CHAT_METADATA_TTL", "300")
+_CHAT_REGISTRATION_TTL = os.environ.get("CHAT_REGISTRATION_TTL", "3600")
+
+# * ANSWER SIMPLE COMMANDS INLINE IN THE WEBHOOK RESPONSE (wait in seconds for the handler)
+_TELEGRAM_WEBHOOK_REPLY = os.environ.get("TELEGRAM_WEBHOOK_REPLY", "false")
+_TELEGRAM_WEBHOOK_REPLY_WAIT = os.environ.get("TELEGRAM_WEBHOOK_REPLY_WAIT", "1")
+
+# * SQLITE FILE PERSISTING USER STATE (empty = in memory only, one file per worker), CHANGES WRITTEN EVERY FLUSH INTERVAL (seconds)
+_PERSISTENCE_PATH = os.environ.get("PERSISTENCE_PATH", "")
+_PERSISTENCE_FLUSH_INTERVAL = os.environ.get("PERSISTENCE_FLUSH_INTERVAL", "1")
+
+# * WEBHOOK WORKER PROCESSES SHARDED BY CHAT (1 = single process), LOCAL PORTS FROM THE BASE PORT UP
+_WEBHOOK_WORKERS = os.environ.get("WEBHOOK_WORKERS", "1")
+_WEBHOOK_WORKER_BASE_PORT = os.environ.get("WEBHOOK_WORKER_BASE_PORT", "9001")
+
+# * UPDATES HANDLED AT ONCE (each chat in order) AND ADMITTED BEFORE INTAKE IS HELD BACK
+_UPDATE_CONCURRENCY = os.environ.get("UPDATE_CONCURRENCY", "64")
+_UPDATE_MAX_BACKLOG = os.environ.get("UPDATE_MAX_BACKLOG", "1000")
+
+# * FILE KEEPING THE HASH OF THE LAST SET BOT COMMANDS, UNCHANGED COMMANDS ARE NOT SET AGAIN
+_COMMANDS_HASH_PATH = os.environ.get("COMMANDS_HASH_PATH", "split-leh.commands")
+
+# * BOT API BASE URL (e.g. a local Bot API server or a fake one for load tests)
+_TELEGRAM_API_BASE_URL = os.environ.get(
+    "TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot"
+)
+
+# * PROMETHEUS METRICS ON /metrics (webhook workers use the ports following METRICS_PORT)
+_METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false")
+_METRICS_PORT = os.environ.get("METRICS_PORT", "9090")
+
+# * TELEGRAM USER IDS ALLOWED TO USE ADMIN COMMANDS (comma separated, e.g. /profile)
+_ADMIN_USER_IDS = os.environ.get("ADMIN_USER_IDS", "")
+
+# * SAMPLING PROFILER, STARTED BY /profile OR SIGUSR1 (interval and durations in seconds)
+_PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+_PROFILE_INTERVAL = os.environ.get("PROFILE_INTERVAL", "0.005")
+_PROFILE_DURATION = os.environ.get("PROFILE_DURATION", "30")
+_PROFILE_MAX_DURATION = os.environ.get("PROFILE_MAX_DURATION", "120")
+
+# * LOGS WRITTEN FROM A QUEUE ON THEIR OWN THREAD, AT MOST LOG_RATE_LIMIT PER SECOND PER MESSAGE BELOW ERROR (0 = no limit)
+_LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+_LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+_LOG_RATE_LIMIT = os.environ.get("LOG_RATE_LIMIT", "20")
+_LOG_QUEUE_SIZE = os.environ.get("LOG_QUEUE_SIZE", "10000")
+
+# * UPDATE IDS REMEMBERED TO DROP REDELIVERED UPDATES (window in seconds), SHARED = ALSO CLAIMED IN THE PERSISTENCE FILE
+_UPDATE_DEDUP_WINDOW = os.environ.get("UPDATE_DEDUP_WINDOW", "3600")
+_UPDATE_DEDUP_MAX_SIZE = os.environ.get("UPDATE_DEDUP_MAX_SIZE", "100000")
+_UPDATE_DEDUP_SHARED = os.environ.get("UPDATE_DEDUP_SHARED", "false")
+
+# * FILE KEEPING THE REGISTERED USER IDS ACROSS RESTARTS AND SHARED BY WORKERS (empty = not saved, the default), RE-EXPORTED FROM THE BACKEND EVERY REFRESH (seconds)
+_KNOWN_USERS_PATH = os.environ.get("KNOWN_USERS_PATH", "")
+_KNOWN_USERS_REFRESH = os.environ.get("KNOWN_USERS_REFRESH", "3600")
+
 
 env = Env(
     ENV=_ENV,
@@ -62,9 +208,63 @@ env = Env(
     MINI_APP_DEEPLINK=_MINI_APP_DEEPLINK,
     API_BASE_URL=_API_BASE_URL,
     API_KEY=_API_KEY,
+    API_USER_CACHE_TTL=float(_API_USER_CACHE_TTL),
+    API_USER_CACHE_NEGATIVE_TTL=float(_API_USER_CACHE_NEGATIVE_TTL),
+    API_USER_CACHE_MAX_SIZE=int(_API_USER_CACHE_MAX_SIZE),
+    API_ADD_MEMBERS_CONCURRENCY=int(_API_ADD_MEMBERS_CONCURRENCY),
+    API_BULK_REPROBE_INTERVAL=float(_API_BULK_REPROBE_INTERVAL),
+    API_POOL_LIMIT=int(_API_POOL_LIMIT),
+    API_POOL_LIMIT_PER_HOST=int(_API_POOL_LIMIT_PER_HOST),
+    API_KEEPALIVE_TIMEOUT=float(_API_KEEPALIVE_TIMEOUT),
+    API_DNS_CACHE_TTL=int(_API_DNS_CACHE_TTL),
+    API_CONNECT_TIMEOUT=float(_API_CONNECT_TIMEOUT),
+    API_TOTAL_TIMEOUT=float(_API_TOTAL_TIMEOUT),
+    API_RETRY_MAX_ATTEMPTS=int(_API_RETRY_MAX_ATTEMPTS),
+    API_RETRY_BASE_DELAY=float(_API_RETRY_BASE_DELAY),
+    API_RETRY_MAX_DELAY=float(_API_RETRY_MAX_DELAY),
+    API_BREAKER_FAILURE_THRESHOLD=int(_API_BREAKER_FAILURE_THRESHOLD),
+    API_BREAKER_RESET_TIMEOUT=float(_API_BREAKER_RESET_TIMEOUT),
+    API_BREAKER_HALF_OPEN_PROBES=int(_API_BREAKER_HALF_OPEN_PROBES),
+    UPDATE_DEADLINE=float(_UPDATE_DEADLINE),
+    TELEGRAM_GLOBAL_RATE_LIMIT=float(_TELEGRAM_GLOBAL_RATE_LIMIT),
+    TELEGRAM_GROUP_RATE_LIMIT=float(_TELEGRAM_GROUP_RATE_LIMIT),
+    TELEGRAM_PRIVATE_RATE_LIMIT=float(_TELEGRAM_PRIVATE_RATE_LIMIT),
+    TELEGRAM_MAX_RETRIES=int(_TELEGRAM_MAX_RETRIES),
+    CHASE_CONCURRENCY=int(_CHASE_CONCURRENCY),
+    CHAT_METADATA_TTL=float(_CHAT_METADATA_TTL),
+    CHAT_REGISTRATION_TTL=float(_CHAT_REGISTRATION_TTL),
+    TELEGRAM_WEBHOOK_REPLY=_TELEGRAM_WEBHOOK_REPLY.lower() in ("1", "true", "yes"),
+    TELEGRAM_WEBHOOK_REPLY_WAIT=float(_TELEGRAM_WEBHOOK_REPLY_WAIT),
+    PERSISTENCE_PATH=_PERSISTENCE_PATH,
+    PERSISTENCE_FLUSH_INTERVAL=float(_PERSISTENCE_FLUSH_INTERVAL),
+    WEBHOOK_WORKERS=int(_WEBHOOK_WORKERS),
+    WEBHOOK_WORKER_BASE_PORT=int(_WEBHOOK_WORKER_BASE_PORT),
+    UPDATE_CONCURRENCY=int(_UPDATE_CONCURRENCY),
+    UPDATE_MAX_BACKLOG=int(_UPDATE_MAX_BACKLOG),
+    COMMANDS_HASH_PATH=_COMMANDS_HASH_PATH,
+    TELEGRAM_API_BASE_URL=_TELEGRAM_API_BASE_URL,
+    METRICS_ENABLED=_METRICS_ENABLED.lower() in ("1", "true", "yes"),
+    METRICS_PORT=int(_METRICS_PORT),
+    ADMIN_USER_IDS=[int(id) for id in _ADMIN_USER_IDS.split(",") if id.strip()],
+    PROFILE_DIR=_PROFILE_DIR,
+    PROFILE_INTERVAL=float(_PROFILE_INTERVAL),
+    PROFILE_DURATION=float(_PROFILE_DURATION),
+    PROFILE_MAX_DURATION=float(_PROFILE_MAX_DURATION),
+    LOG_LEVEL=_LOG_LEVEL.upper(),
+    LOG_FORMAT=cast(Literal["json", "text"], _LOG_FORMAT.lower()),
+    LOG_RATE_LIMIT=float(_LOG_RATE_LIMIT),
+    LOG_QUEUE_SIZE=int(_LOG_QUEUE_SIZE),
+    UPDATE_DEDUP_WINDOW=float(_UPDATE_DEDUP_WINDOW),
+    UPDATE_DEDUP_MAX_SIZE=int(_UPDATE_DEDUP_MAX_SIZE),
+    UPDATE_DEDUP_SHARED=_UPDATE_DEDUP_SHARED.lower() in ("1", "true", "yes"),
+    KNOWN_USERS_PATH=_KNOWN_USERS_PATH,
+    KNOWN_USERS_REFRESH=float(_KNOWN_USERS_REFRESH),
 )
 
+# * Never print secrets
+SECRETS = ("TELEGRAM_BOT_TOKEN", "API_KEY")
+
 print("[env.py] Environment variables loaded successfully")
 print("==============================================")
-pprint(env.model_dump())
+pprint(env.model_dump(exclude=set(SECRETS)))
 print("==============================================\n")
@@ -0,0 +1,97 @@
+import logging
+from typing import Optional, Union
+import telegram
+from telegram import Bot, Chat
+from api import Api, CreateChatPayload, CreateChatResult
+from cache import TTLCache
+from concurrency import SingleFlight
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Telegram guarantees a file path stays downloadable for at least an hour
+PHOTO_PATH_TTL = 50 * 60
+
+
+class GroupBootstrap:
+    """Registers groups the bot is added to with the backend.
+
+    Chat metadata and photo file paths are cached so re-adds do not hit Telegram
+    again, and a group registered successfully within `registration_ttl` is not
+    sent to the backend again at all. Concurrent bootstraps of the same group
+    (e.g. several service messages for one add) share a single run, bootstraps
+    of different groups run fully in parallel.
+    """
+
+    def __init__(
+        self,
+        api: Api,
+        metadata_ttl: float = 300,
+        registration_ttl: float = 3600,
+        max_chats: int = 10_000,
+    ):
+        self.api = api
+        self.chats: TTLCache[int, telegram.ChatFullInfo] = TTLCache(
+            max_size=max_chats, ttl=metadata_ttl
+        )
+        # * Keyed by the file unique id, which survives a bot token change
+        self.photo_paths: TTLCache[str, Optional[str]] = TTLCache(
+            max_size=max_chats, ttl=PHOTO_PATH_TTL
+        )
+        self.registered: TTLCache[int, CreateChatResult] = TTLCache(
+            max_size=max_chats, ttl=registration_ttl
+        )
+        self.single_flight: SingleFlight[Union[CreateChatResult, Exception]] = (
+            SingleFlight()
+        )
+        self.skipped = 0
+
+    async def register(
+        self, bot: Bot, chat: Chat, deadline: Optional[Deadline] = None
+    ) -> Union[CreateChatResult, Exception]:
+        registered = self.registered.get(chat.id)
+        if registered is not None:
+            self.skipped += 1
+            return registered
+
+        return await self.single_flight.do(
+            chat.id, lambda: self._register(bot, chat, deadline)
+        )
+
+    async def _register(
+        self, bot: Bot, chat: Chat, deadline: Optional[Deadline]
+    ) -> Union[CreateChatResult, Exception]:
+        try:
+            chat_photo_url = await self._photo_url(bot, chat.id)
+        except telegram.error.TelegramError as e:
+            return e
+
+        payload = CreateChatPayload(
+            chat_id=chat.id,
+            chat_title=chat.title or f"Group:{chat.id}",
+            chat_type=chat.type,
+            chat_photo_url=chat_photo_url,
+        )
+        result = await self.api.create_chat(payload, deadline=deadline)
+        if not isinstance(result, Exception):
+            self.registered.set(chat.id, result)
+        return result
+
+    async def _photo_url(self, bot: Bot, chat_id: int) -> Optional[str]:
+        # get_file needs the photo's file id from get_chat, so the two can not
+        # overlap, the caches make a re-add skip either or both
+        full_chat = self.chats.get(chat_id)
+        if full_chat is None:
+            full_chat = await bot.get_chat(chat_id=chat_id)
+            self.chats.set(chat_id, full_chat)
+
+        if full_chat.photo is None:
+            return None
+
+        file_key = full_chat.photo.big_file_unique_id
+        path = self.photo_paths.get(file_key)
+        if path is None:
+            photo = await bot.get_file(full_chat.photo.big_file_id)
+            path = photo.file_path
+            self.photo_paths.set(file_key, path)
+        return path
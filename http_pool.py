@@ -0,0 +1,88 @@
+import time
+from types import SimpleNamespace
+import aiohttp
+from pydantic import BaseModel
+from env import env
+
+
+class PoolStats(BaseModel):
+    limit: int
+    limit_per_host: int
+    open: int
+    in_use: int
+    idle: int
+    connections_created: int
+    connections_reused: int
+    acquire_waits: int
+    acquire_wait_total_ms: float
+    acquire_wait_max_ms: float
+
+
+def build_connector() -> aiohttp.TCPConnector:
+    """Build the pooled connector for the Api session from env settings"""
+    return aiohttp.TCPConnector(
+        limit=env.API_POOL_LIMIT,
+        limit_per_host=env.API_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=env.API_KEEPALIVE_TIMEOUT,
+        use_dns_cache=env.API_DNS_CACHE_TTL > 0,
+        ttl_dns_cache=env.API_DNS_CACHE_TTL or None,
+    )
+
+
+def build_timeout() -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        total=env.API_TOTAL_TIMEOUT,
+        connect=env.API_CONNECT_TIMEOUT,
+    )
+
+
+class PoolMonitor:
+    """Collects connection pool statistics through aiohttp tracing hooks"""
+
+    def __init__(self, connector: aiohttp.TCPConnector):
+        self.connector = connector
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.acquire_waits = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_queued_start.append(self._on_queued_start)
+        self.trace_config.on_connection_queued_end.append(self._on_queued_end)
+        self.trace_config.on_connection_create_end.append(self._on_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuseconn)
+
+    async def _on_queued_start(self, session, context: SimpleNamespace, params):
+        context.queued_at = time.perf_counter()
+
+    async def _on_queued_end(self, session, context: SimpleNamespace, params):
+        waited = time.perf_counter() - context.queued_at
+        self.acquire_waits += 1
+        self.acquire_wait_total += waited
+        self.acquire_wait_max = max(self.acquire_wait_max, waited)
+
+    async def _on_create_end(self, session, context, params):
+        self.connections_created += 1
+
+    async def _on_reuseconn(self, session, context, params):
+        self.connections_reused += 1
+
+    def stats(self) -> PoolStats:
+        connector = self.connector
+        # aiohttp does not expose pool occupancy publicly, read it defensively
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        in_use = len(getattr(connector, "_acquired", ()))
+
+        return PoolStats(
+            limit=connector.limit,
+            limit_per_host=connector.limit_per_host,
+            open=idle + in_use,
+            in_use=in_use,
+            idle=idle,
+            connections_created=self.connections_created,
+            connections_reused=self.connections_reused,
+            acquire_waits=self.acquire_waits,
+            acquire_wait_total_ms=self.acquire_wait_total * 1000,
+            acquire_wait_max_ms=self.acquire_wait_max * 1000,
+        )
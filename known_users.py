@@ -0,0 +1,363 @@
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Iterable, Optional, Tuple, Union
+from pydantic import BaseModel
+from api import Api
+
+# * Locks are advisory and POSIX only, elsewhere every process refreshes on its own
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# * Containers of more values than this are bitmaps, fewer are sorted arrays
+ARRAY_MAX = 4_096
+BITMAP_BYTES = 65_536 // 8
+
+ARRAY = 0
+BITMAP = 1
+# * Container: high 48 bits, kind, value count
+CONTAINER_HEADER = struct.Struct("<QBI")
+# * File: version, time the ids were exported at (0 for never)
+FILE_HEADER = struct.Struct("<4sd")
+FILE_VERSION = b"KU02"
+
+# * Refresh once a snapshot is this share of the refresh interval old, so the next
+# * one is in before misses stop being certain
+REFRESH_AT = 0.9
+# * Seconds before retrying a failed refresh, at most the refresh interval
+REFRESH_RETRY = 60
+# * Ids added this long before an export started may still be missing from it
+EXPORT_SKEW = 60
+
+Container = Union["array[int]", bytearray]
+
+
+class RoaringBitmap:
+    """Exact set of non-negative integers, roaring style.
+
+    Values are split on their low 16 bits: the high bits pick a container, holding
+    the low bits as a sorted uint16 array (2 bytes a value) while sparse, or as an
+    8 KiB bitmap once dense. Telegram user ids are sparse, so most containers are
+    small arrays.
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers: Dict[int, Container] = {}
+        self._size = 0
+        self.update(values)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def add(self, value: int) -> bool:
+        """Add the value, returns whether it was new"""
+        if value < 0:
+            raise ValueError(f"Negative value: {value}")
+
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array("H", (low,))
+        elif isinstance(container, bytearray):
+            bit = 1 << (low & 7)
+            if container[low >> 3] & bit:
+                return False
+            container[low >> 3] |= bit
+        else:
+            index = bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                return False
+            container.insert(index, low)
+            if len(container) > ARRAY_MAX:
+                self._containers[high] = self._to_bitmap(container)
+        self._size += 1
+        return True
+
+    def update(self, values: Iterable[int]):
+        """Add many values, sorted up front so each container is built in one go"""
+        for high, group in itertools.groupby(
+            sorted(set(values)), key=lambda x: x >> 16
+        ):
+            if high < 0:
+                raise ValueError(f"Negative values in {high << 16}..")
+            lows = [value & 0xFFFF for value in group]
+            if high in self._containers:
+                for low in lows:
+                    self.add((high << 16) | low)
+                continue
+            container = array("H", lows)
+            self._containers[high] = (
+                self._to_bitmap(container) if len(container) > ARRAY_MAX else container
+            )
+            self._size += len(lows)
+
+    @staticmethod
+    def _to_bitmap(container: "array[int]") -> bytearray:
+        bitmap = bytearray(BITMAP_BYTES)
+        for low in container:
+            bitmap[low >> 3] |= 1 << (low & 7)
+        return bitmap
+
+    def to_bytes(self) -> bytes:
+        parts = []
+        for high, container in sorted(self._containers.items()):
+            if isinstance(container, bytearray):
+                count = sum(bin(byte).count("1") for byte in container)
+                parts.append(CONTAINER_HEADER.pack(high, BITMAP, count))
+                parts.append(bytes(container))
+            else:
+                parts.append(CONTAINER_HEADER.pack(high, ARRAY, len(container)))
+                parts.append(container.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RoaringBitmap":
+        bitmap = cls()
+        offset = 0
+        while offset < len(data):
+            high, kind, count = CONTAINER_HEADER.unpack_from(data, offset)
+            offset += CONTAINER_HEADER.size
+            if kind == BITMAP:
+                container: Container = bytearray(data[offset : offset + BITMAP_BYTES])
+                offset += BITMAP_BYTES
+            else:
+                container = array("H")
+                container.frombytes(data[offset : offset + count * 2])
+                offset += count * 2
+            bitmap._containers[high] = container
+            bitmap._size += count
+        return bitmap
+
+
+class KnownUsersStats(BaseModel):
+    size: int
+    complete: bool
+    age_s: Optional[float]
+    known: int
+    unknown: int
+    uncertain: int
+    refreshes: int
+    adopted: int
+    refresh_errors: int
+
+
+class KnownUsers:
+    """Ids of the users registered with the backend, to answer /start without
+    looking the user up.
+
+    Built from the backend's bulk export of user ids and kept current with the
+    users created since. While its export is younger than `refresh_interval` it
+    is complete: an id missing from it is a user to create. Once older, or
+    before any export, misses are uncertain and need a lookup.
+
+    It is saved to `path`, with the time of its export, so a restart is warm at
+    once and trusted for misses as long as that export is recent. Processes
+    sharing `path`, e.g. webhook workers, take turns through a lock file, and one
+    that finds a recent export saved by another adopts it instead of exporting
+    again, so the backend sees about one export per refresh interval.
+    """
+
+    def __init__(self, api: Api, path: Optional[str], refresh_interval: float = 3600):
+        self.api = api
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.users = RoaringBitmap()
+        # * Wall clock time the ids were exported at, 0 before any export
+        self.exported_at = 0.0
+        # * Ids added here with the time, until a snapshot exported after them is in
+        self._recent: Deque[Tuple[float, int]] = deque()
+        self._refresher: Optional["asyncio.Task[None]"] = None
+
+        self.known = 0
+        self.unknown = 0
+        self.uncertain = 0
+        self.refreshes = 0
+        self.adopted = 0
+        self.refresh_errors = 0
+
+    @property
+    def complete(self) -> bool:
+        return self._age(self.exported_at) < self.refresh_interval
+
+    def _age(self, exported_at: float) -> float:
+        return time.time() - exported_at if exported_at else float("inf")
+
+    def lookup(self, user_id: int) -> Optional[bool]:
+        """True for a registered user, False for one that is not, None when unsure"""
+        if user_id in self.users:
+            self.known += 1
+            return True
+        if self.complete:
+            self.unknown += 1
+            return False
+        self.uncertain += 1
+        return None
+
+    def add(self, user_id: int):
+        self.users.add(user_id)
+        self._recent.append((time.time(), user_id))
+
+    def _install(self, users: RoaringBitmap, exported_at: float):
+        """Switch to an exported snapshot, keeping the ids added here since shortly
+        before its export"""
+        while self._recent and self._recent[0][0] < exported_at - EXPORT_SKEW:
+            self._recent.popleft()
+        users.update(user_id for _, user_id in self._recent)
+        self.users = users
+        self.exported_at = exported_at
+
+    async def start(self):
+        """Load the saved ids, then refresh from the backend in the background"""
+        loaded = await self._load_saved()
+        if loaded is not None:
+            self._install(*loaded)
+            logger.info(
+                "[known_users] - loaded %s users, complete: %s",
+                len(self.users),
+                self.complete,
+            )
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+        await self.save()
+
+    async def _refresh_loop(self):
+        while True:
+            due_in = self.refresh_interval * REFRESH_AT - self._age(self.exported_at)
+            if due_in > 0:
+                await asyncio.sleep(due_in)
+            if not await self.refresh():
+                await asyncio.sleep(min(REFRESH_RETRY, self.refresh_interval))
+
+    async def refresh(self) -> bool:
+        async with self._exclusive():
+            # * Another process may have exported while this one waited for the lock
+            loaded = await self._load_saved()
+            if (
+                loaded is not None
+                and loaded[1] > self.exported_at
+                and self._age(loaded[1]) < self.refresh_interval * REFRESH_AT
+            ):
+                self._install(*loaded)
+                self.adopted += 1
+                logger.info("[known_users] - adopted %s saved users", len(self.users))
+                return True
+
+            exported_at = time.time()
+            result = await self.api.export_user_ids()
+            if isinstance(result, Exception):
+                self.refresh_errors += 1
+                logger.warning("[known_users] - api.export_user_ids: %s", result)
+                return False
+
+            users = await asyncio.to_thread(RoaringBitmap, result.user_ids)
+            self._install(users, exported_at)
+            self.refreshes += 1
+            logger.info("[known_users] - warmed with %s users", len(users))
+            await self.save()
+        return True
+
+    @asynccontextmanager
+    async def _exclusive(self) -> AsyncIterator[None]:
+        """Hold the lock file next to `path`, polling so waiting stays cancellable"""
+        if self.path is None or fcntl is None:
+            yield
+            return
+
+        try:
+            lock = open(f"{self.path}.lock", "a")
+        except OSError as e:
+            logger.warning("[known_users] - unable to open the lock file: %s", e)
+            yield
+            return
+        try:
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(0.1)
+            yield
+        finally:
+            # * Closing the file releases the lock
+            lock.close()
+
+    async def _load_saved(self) -> Optional[Tuple[RoaringBitmap, float]]:
+        if self.path is None:
+            return None
+        try:
+            return await asyncio.to_thread(self._load, self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("[known_users] - unable to load %s: %s", self.path, e)
+            return None
+
+    async def save(self):
+        if self.path is None:
+            return
+        try:
+            await asyncio.to_thread(self._save, self.path, self.users, self.exported_at)
+        except OSError as e:
+            logger.warning("[known_users] - unable to save %s: %s", self.path, e)
+
+    @staticmethod
+    def _load(path: str) -> Optional[Tuple[RoaringBitmap, float]]:
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        version, exported_at = FILE_HEADER.unpack_from(data)
+        if version != FILE_VERSION:
+            raise ValueError(f"Unknown version {version!r}")
+        return RoaringBitmap.from_bytes(data[FILE_HEADER.size :]), exported_at
+
+    @staticmethod
+    def _save(path: str, users: RoaringBitmap, exported_at: float):
+        # Replace atomically, several workers may save at the same time
+        temporary_path = f"{path}.{os.getpid()}"
+        with open(temporary_path, "wb") as file:
+            file.write(FILE_HEADER.pack(FILE_VERSION, exported_at))
+            file.write(users.to_bytes())
+        os.replace(temporary_path, path)
+
+    def stats(self) -> KnownUsersStats:
+        age = self._age(self.exported_at)
+        return KnownUsersStats(
+            size=len(self.users),
+            complete=self.complete,
+            age_s=age if self.exported_at else None,
+            known=self.known,
+            unknown=self.unknown,
+            uncertain=self.uncertain,
+            refreshes=self.refreshes,
+            adopted=self.adopted,
+            refresh_errors=self.refresh_errors,
+        )
@@ -0,0 +1,153 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Tuple
+from pydantic import BaseModel
+import codec
+
+# * Attributes every LogRecord has, anything else on a record came in through `extra`
+RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra` fields next to the message"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = (
+                    value
+                    if value is None or isinstance(value, (str, int, float, bool))
+                    else str(value)
+                )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return codec.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records per second of each message template
+    below `exempt_level`, in bursts of up to `rate`. The next record let through
+    carries the number suppressed in between.
+
+    Templates are the unformatted messages, so hot path logs written with lazy
+    arguments (`logger.info("added %s", name)`) share one budget.
+    """
+
+    def __init__(self, rate: float, exempt_level: int = logging.ERROR):
+        super().__init__()
+        self.rate = rate
+        self.exempt_level = exempt_level
+        # * Per (logger, template): tokens, last refill, suppressed since last emit
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.exempt_level:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.rate, now, 0]
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to a listener thread without formatting them, dropping records
+    when the queue is full instead of blocking the caller"""
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # * Formatting, arguments included, happens on the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    level: str = "INFO",
+    json: bool = True,
+    rate_limit: float = 0,
+    queue_size: int = 10_000,
+) -> QueueListener:
+    """Route all logging through a bounded queue to a stderr handler on its own
+    thread, so writing logs never blocks the event loop. `rate_limit` records per
+    second per message template below ERROR, 0 for no limit."""
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(
+        JsonFormatter()
+        if json
+        else logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    # * Write out what is still queued on exit
+    atexit.register(listener.stop)
+    return listener
+
+
+class LogStats(BaseModel):
+    # * Records lost to a full queue, and left out by the rate limit
+    dropped: int
+    suppressed: int
+
+
+def stats() -> LogStats:
+    dropped = 0
+    suppressed = 0
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            dropped += handler.dropped
+            suppressed += sum(
+                log_filter.suppressed
+                for log_filter in handler.filters
+                if isinstance(log_filter, RateLimitFilter)
+            )
+    return LogStats(dropped=dropped, suppressed=suppressed)
@@ -0,0 +1,250 @@
+import asyncio
+import functools
+import math
+import time
+from bisect import bisect_left
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+from telegram.ext import Application
+
+T = TypeVar("T")
+
+# * Seconds, from a cached reply to a slow backend call under retries
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+# * Instrumented code checks this before taking any timing, off by default
+enabled = False
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Labels = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # * Per label values: count per bucket (plus +Inf), sum
+        self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.label_names, label_values, f'le="{_format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Collected:
+    """Gauge or counter read from a callback at scrape time, e.g. from the counters
+    an existing `stats()` already keeps"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: Literal["gauge", "counter"],
+        collect: Callable[[], Iterable[Sample]],
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for labels, value in self.collect():
+            names = tuple(labels)
+            rendered = _format_labels(names, tuple(labels[name] for name in names))
+            lines.append(f"{self.name}{rendered} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric: T) -> T:
+        self._metrics[metric.name] = metric  # type: ignore[attr-defined]
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(
+    Histogram(
+        "bot_handler_duration_seconds",
+        "Time spent in update handlers",
+        ("handler", "outcome"),
+    )
+)
+API_LATENCY = registry.register(
+    Histogram(
+        "api_request_duration_seconds",
+        "Backend API calls including retries, by endpoint and status",
+        ("endpoint", "status"),
+    )
+)
+TELEGRAM_LATENCY = registry.register(
+    Histogram(
+        "telegram_request_duration_seconds",
+        "Bot API calls once released by the rate limiter",
+        ("method", "outcome"),
+    )
+)
+UPDATE_QUEUE_LAG = registry.register(
+    Histogram(
+        "update_queue_lag_seconds",
+        "Time updates wait in the scheduler before a handler runs",
+    )
+)
+
+
+def instrument(name: str, callback: Callable[..., Awaitable[T]]):
+    """Time a handler callback, returns it untouched when metrics are off"""
+    if not enabled:
+        return callback
+
+    @functools.wraps(callback)
+    async def timed(*args: Any, **kwargs: Any) -> T:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await callback(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name, outcome)
+
+    return timed
+
+
+def instrument_handlers(application: Application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            name = getattr(handler.callback, "__name__", type(handler).__name__)
+            handler.callback = instrument(name, handler.callback)
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format on `/metrics`"""
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._runner: Optional[Any] = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def scrape(request: web.Request) -> web.Response:
+            return web.Response(
+                text=registry.render(), content_type="text/plain", charset="utf-8"
+            )
+
+        server = web.Application()
+        server.router.add_get("/metrics", scrape)
+        self._runner = web.AppRunner(server)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def timed_call(
+    method: str, callback: Callable[..., Awaitable[T]], /, *args: Any, **kwargs: Any
+) -> T:
+    """Time a Bot API call, untouched when metrics are off"""
+    if not enabled:
+        return await callback(*args, **kwargs)
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await callback(*args, **kwargs)
+        outcome = "ok"
+        return result
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        TELEGRAM_LATENCY.observe(time.perf_counter() - started, method, outcome)
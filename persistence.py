@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple, Union
+from pydantic import BaseModel
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# * (kind, key) of a stored row, e.g. ("user", "257256809")
+RowKey = Tuple[str, str]
+ConversationKey = Tuple[Union[int, str], ...]
+
+USER_DATA = "user"
+CHAT_DATA = "chat"
+BOT_DATA = "bot"
+CONVERSATION = "conversation:"
+
+
+class Store(ABC):
+    """Durable backend of `WriteBehindPersistence`.
+
+    Methods are blocking and always called off the event loop, one at a time.
+    """
+
+    @abstractmethod
+    def load(self) -> Dict[RowKey, bytes]: ...
+
+    @abstractmethod
+    def write(self, batch: Dict[RowKey, Optional[bytes]]):
+        """Write the batch atomically, a None value deletes the row"""
+
+    def close(self):
+        pass
+
+
+class SqliteStore(Store):
+    """Rows in a single SQLite table, in WAL mode so readers never block the writer"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Only ever used from one thread at a time, but not always the same one
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # * WAL + NORMAL survives process crashes, only an OS crash may lose the last commit
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS persistence ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (kind, key)) WITHOUT ROWID"
+            )
+            self._connection = connection
+        return self._connection
+
+    def load(self) -> Dict[RowKey, bytes]:
+        rows = self._connect().execute("SELECT kind, key, data FROM persistence")
+        return {(kind, key): data for kind, key, data in rows}
+
+    def write(self, batch: Dict[RowKey, Optional[bytes]]):
+        upserts = [
+            (kind, key, data) for (kind, key), data in batch.items() if data is not None
+        ]
+        deletes = [row_key for row_key, data in batch.items() if data is None]
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO persistence (kind, key, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data",
+                upserts,
+            )
+            connection.executemany(
+                "DELETE FROM persistence WHERE kind = ? AND key = ?", deletes
+            )
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class PersistenceStats(BaseModel):
+    pending: int
+    flushes: int
+    rows_written: int
+    unchanged_skipped: int
+    flush_errors: int
+    last_flush_ms: float
+
+
+class WriteBehindPersistence(
+    BasePersistence[Dict[Any, Any], Dict[Any, Any], Dict[Any, Any]]
+):
+    """Persistence buffering changes in memory and writing them to a `Store` in
+    batches from a background task.
+
+    Updates only snapshot the changed data, so handlers never wait on disk. Data
+    that did not change since it was last written is skipped. A change reaches
+    the store at most `update_interval` (when the Application hands it over)
+    plus `flush_interval` seconds later, which bounds what a crash can lose; a
+    regular shutdown flushes everything.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        flush_interval: float = 1,
+        max_pending: int = 1_000,
+        store_data: Optional[PersistenceInput] = None,
+        update_interval: float = 1,
+    ):
+        super().__init__(
+            store_data=store_data or PersistenceInput(callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._rows: Optional[Dict[RowKey, bytes]] = None
+        # * Digest of what the store holds per row, to skip unchanged data
+        self._written: Dict[RowKey, bytes] = {}
+        self._pending: Dict[RowKey, Optional[bytes]] = {}
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._closing = False
+        self._write_lock = asyncio.Lock()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.unchanged_skipped = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    # * Loading, once at startup
+    # *=============================================================================================
+
+    async def _load(self) -> Dict[RowKey, bytes]:
+        if self._rows is None:
+            self._rows = await asyncio.to_thread(self.store.load)
+            self._written = {
+                row_key: _digest(data) for row_key, data in self._rows.items()
+            }
+        return self._rows
+
+    async def _load_kind(self, kind: str) -> Dict[str, Any]:
+        rows = await self._load()
+        return {
+            key: pickle.loads(data)
+            for (row_kind, key), data in rows.items()
+            if row_kind == kind
+        }
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {
+            int(key): data for key, data in (await self._load_kind(USER_DATA)).items()
+        }
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {
+            int(key): data for key, data in (await self._load_kind(CHAT_DATA)).items()
+        }
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return (await self._load_kind(BOT_DATA)).get("", {})
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[ConversationKey, object]:
+        return {
+            tuple(json.loads(key)): state
+            for key, state in (await self._load_kind(CONVERSATION + name)).items()
+        }
+
+    # * Updates, buffered and written behind
+    # *=============================================================================================
+
+    def _stage(self, row_key: RowKey, data: Any):
+        blob = None if data is None else pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        digest = None if blob is None else _digest(blob)
+        if digest == self._written.get(row_key) and row_key not in self._pending:
+            self.unchanged_skipped += 1
+            return
+
+        self._pending[row_key] = blob
+        if self._flusher is None and not self._closing:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # Users without any state are dropped instead of kept as empty rows
+        self._stage((USER_DATA, str(user_id)), data or None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._stage((CHAT_DATA, str(chat_id)), data or None)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._stage((BOT_DATA, ""), data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(
+        self, name: str, key: ConversationKey, new_state: Optional[object]
+    ) -> None:
+        self._stage((CONVERSATION + name, json.dumps(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage((USER_DATA, str(user_id)), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage((CHAT_DATA, str(chat_id)), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    # * Flushing
+    # *=============================================================================================
+
+    async def _flush_periodically(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._write_pending()
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.store.write, batch)
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error(
+                    "[persistence] - write of %s rows failed: %s", len(batch), e
+                )
+                # Keep newer changes staged meanwhile, retry the rest on the next flush
+                self._pending = {**batch, **self._pending}
+                return
+
+            for row_key, blob in batch.items():
+                if blob is None:
+                    self._written.pop(row_key, None)
+                else:
+                    self._written[row_key] = _digest(blob)
+            self.flushes += 1
+            self.rows_written += len(batch)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def flush(self) -> None:
+        """Called by the Application on shutdown, writes everything still pending"""
+        self._closing = True
+        if self._flusher is not None:
+            # Let a write in progress finish rather than cancelling it halfway
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+        await self._write_pending()
+        await asyncio.to_thread(self.store.close)
+
+    def stats(self) -> PersistenceStats:
+        return PersistenceStats(
+            pending=len(self._pending),
+            flushes=self.flushes,
+            rows_written=self.rows_written,
+            unchanged_skipped=self.unchanged_skipped,
+            flush_errors=self.flush_errors,
+            last_flush_ms=self.last_flush_ms,
+        )
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
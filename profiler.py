@@ -0,0 +1,127 @@
+import asyncio
+import inspect
+import os
+import sys
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Dict, Optional
+from pydantic import BaseModel
+from telegram.ext import Application
+
+# * Root frame of samples taken while no handler is on the stack
+IDLE = "idle"
+OTHER = "other"
+
+
+class ProfileResult(BaseModel):
+    path: str
+    samples: int
+    duration_s: float
+    # * Samples per handler, plus idle (loop waiting for I/O) and other (tasks, loop)
+    handlers: Dict[str, int]
+
+
+def handler_codes(application: Application) -> Dict[CodeType, str]:
+    """Code objects of the handler callbacks, seen through any instrumenting wrapper"""
+    codes: Dict[CodeType, str] = {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = inspect.unwrap(handler.callback)
+            code = getattr(callback, "__code__", None)
+            if code is not None:
+                codes[code] = callback.__name__
+    return codes
+
+
+def frame_name(code: CodeType) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a thread of its own, for a bounded
+    window, and writes the samples as collapsed stacks (`flamegraph.pl`, speedscope).
+
+    Each sample is rooted at the handler on the stack, found by its code object,
+    so nothing is wrapped or timed while no profile runs: it costs nothing when off.
+    Time spent awaiting is not on the stack, a handler waiting for the backend shows
+    up as idle loop time instead.
+    """
+
+    def __init__(
+        self,
+        codes: Dict[CodeType, str],
+        output_dir: str,
+        interval: float = 0.005,
+        max_duration: float = 120,
+    ):
+        self.codes = codes
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self.running = False
+
+    async def profile(self, duration: float) -> Optional[ProfileResult]:
+        """Profile the calling event loop for `duration` seconds, capped at
+        `max_duration`. Returns None when a profile is already running."""
+        if self.running:
+            return None
+
+        self.running = True
+        try:
+            duration = min(duration, self.max_duration)
+            thread_id = threading.get_ident()
+            started = time.monotonic()
+            stacks = await asyncio.to_thread(self._sample, thread_id, duration)
+            elapsed = time.monotonic() - started
+            return await asyncio.to_thread(self._write, stacks, elapsed)
+        finally:
+            self.running = False
+
+    def _sample(self, thread_id: int, duration: float) -> Dict[str, int]:
+        stacks: Dict[str, int] = {}
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = self._collapse(frame)
+                stacks[stack] = stacks.get(stack, 0) + 1
+            time.sleep(self.interval)
+        return stacks
+
+    def _collapse(self, frame: Optional[FrameType]) -> str:
+        names = []
+        handler = None
+        while frame is not None:
+            code = frame.f_code
+            names.append(frame_name(code))
+            # * The outermost handler on the stack names the sample
+            handler = self.codes.get(code, handler)
+            frame = frame.f_back
+        names.reverse()
+
+        if handler is None:
+            # * A loop blocked in select is waiting for I/O
+            top = names[-1] if names else ""
+            handler = IDLE if top.startswith("selectors.py:") else OTHER
+        return ";".join([handler, *names])
+
+    def _write(self, stacks: Dict[str, int], elapsed: float) -> ProfileResult:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir,
+            f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+        )
+        handlers: Dict[str, int] = {}
+        with open(path, "w") as file:
+            for stack, count in sorted(stacks.items()):
+                file.write(f"{stack} {count}\n")
+                handler = stack.split(";", 1)[0]
+                handlers[handler] = handlers.get(handler, 0) + count
+
+        return ProfileResult(
+            path=path,
+            samples=sum(stacks.values()),
+            duration_s=elapsed,
+            handlers=dict(sorted(handlers.items(), key=lambda x: x[1], reverse=True)),
+        )
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+from pydantic import BaseModel
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import metrics
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Outbound request classes, lower values are sent first"""
+
+    REPLY = 0
+    CHAT_ACTION = 1
+    PIN = 2
+    REMINDER = 3
+
+
+# * Priority of requests not given one explicitly through `rate_limit_args`
+ENDPOINT_PRIORITIES = {
+    "sendChatAction": Priority.CHAT_ACTION,
+    "pinChatMessage": Priority.PIN,
+    "unpinChatMessage": Priority.PIN,
+}
+
+
+class Throttle:
+    """Generic cell rate algorithm: `rate` requests per `period` seconds with
+    bursts of up to `burst` requests. Reserving a slot returns how long to wait."""
+
+    def __init__(
+        self,
+        rate: float,
+        period: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.interval = period / rate
+        self.tolerance = self.interval * (burst - 1)
+        self._clock = clock
+        self._tat = 0.0
+
+    def reserve(self) -> float:
+        now = self._clock()
+        tat = max(self._tat, now)
+        self._tat = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def try_reserve(self) -> bool:
+        """Reserve a slot only if it is available without waiting"""
+        now = self._clock()
+        tat = max(self._tat, now)
+        if tat - self.tolerance > now:
+            return False
+        self._tat = tat + self.interval
+        return True
+
+
+class PriorityStats(BaseModel):
+    queued: int
+    sent: int
+    wait_total_ms: float
+    wait_max_ms: float
+
+
+class RateLimiterStats(BaseModel):
+    queue_depth: int
+    tracked_chats: int
+    retry_afters: int
+    paused_for_ms: float
+    priorities: Dict[str, PriorityStats]
+
+
+class PriorityRateLimiter(BaseRateLimiter[Priority]):
+    """Outbound scheduler enforcing Telegram's global and per chat budgets.
+
+    Requests first wait for their chat's budget, then queue for the global budget
+    which is handed out by priority, so replies overtake chat actions, pins and
+    reminders under load. A RetryAfter pauses all sending before the request is
+    retried.
+    """
+
+    def __init__(
+        self,
+        overall_max_rate: float = 30,
+        overall_time_period: float = 1,
+        group_max_rate: float = 20,
+        group_time_period: float = 60,
+        private_max_rate: float = 1,
+        private_time_period: float = 1,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        max_chats: int = 10_000,
+    ):
+        self._overall = Throttle(
+            overall_max_rate, overall_time_period, burst=max(1, int(overall_max_rate))
+        )
+        self._group_rate = (group_max_rate, group_time_period)
+        self._private_rate = (private_max_rate, private_time_period)
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        # * Idle chats fall out and start over with a full burst budget
+        self._chats: TTLCache[int, Throttle] = TTLCache(
+            max_size=max_chats, ttl=max(group_time_period, private_time_period) * 10
+        )
+
+        self._queue: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional["asyncio.Task[None]"] = None
+        self._paused_until = 0.0
+
+        self.retry_afters = 0
+        self._queued = {priority: 0 for priority in Priority}
+        self._sent = {priority: 0 for priority in Priority}
+        self._wait_total = {priority: 0.0 for priority in Priority}
+        self._wait_max = {priority: 0.0 for priority in Priority}
+
+    async def initialize(self) -> None:
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, future in self._queue:
+            future.cancel()
+        self._queue.clear()
+
+    def _chat_throttle(self, chat_id: int) -> Throttle:
+        throttle = self._chats.get(chat_id)
+        if throttle is None:
+            rate, period = self._group_rate if chat_id < 0 else self._private_rate
+            throttle = Throttle(rate, period, burst=self._chat_burst)
+        # Re-set on every use to keep active chats from expiring
+        self._chats.set(chat_id, throttle)
+        return throttle
+
+    def try_acquire(self, chat_id: int) -> bool:
+        """Take the chat and global budget for a request sent outside of the limiter
+        (e.g. inline in a webhook response), only if it would go out right away"""
+        if self._queue or self._paused_until > time.monotonic():
+            return False
+        if not self._chat_throttle(chat_id).try_reserve():
+            return False
+        return self._overall.try_reserve()
+
+    async def _dispatch(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self._overall.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Pop only after waiting, so requests arriving meanwhile compete on priority
+            while self._queue:
+                priority, _, future = heapq.heappop(self._queue)
+                self._queued[Priority(priority)] -= 1
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _acquire(self, chat_id: int, priority: Priority):
+        delay = self._chat_throttle(chat_id).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        self._queued[priority] += 1
+        self._wakeup.set()
+        await future
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Priority],
+    ) -> Union[bool, Dict[str, Any], List]:
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            # Not addressed to a chat (or a channel username), no flood limits apply
+            return await metrics.timed_call(endpoint, callback, *args, **kwargs)
+
+        priority = (
+            rate_limit_args
+            if rate_limit_args is not None
+            else ENDPOINT_PRIORITIES.get(endpoint, Priority.REPLY)
+        )
+
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire(chat_id, priority)
+            waited = time.monotonic() - queued_at
+            self._sent[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+
+            try:
+                return await metrics.timed_call(endpoint, callback, *args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == self._max_retries:
+                    raise
+
+                retry_after = exc.retry_after
+                sleep = (
+                    retry_after.total_seconds()
+                    if hasattr(retry_after, "total_seconds")
+                    else float(retry_after)
+                ) + 0.1
+                self.retry_afters += 1
+                logger.warning(
+                    "[rate_limiter] - %s to %s: retry after %ss",
+                    endpoint,
+                    chat_id,
+                    sleep,
+                )
+                # * Hold back all sending, not just this chat
+                self._paused_until = max(self._paused_until, time.monotonic() + sleep)
+                await asyncio.sleep(sleep)
+                attempt += 1
+
+    def stats(self) -> RateLimiterStats:
+        return RateLimiterStats(
+            queue_depth=len(self._queue),
+            tracked_chats=len(self._chats),
+            retry_afters=self.retry_afters,
+            paused_for_ms=max(0.0, self._paused_until - time.monotonic()) * 1000,
+            priorities={
+                priority.name.lower(): PriorityStats(
+                    queued=self._queued[priority],
+                    sent=self._sent[priority],
+                    wait_total_ms=self._wait_total[priority] * 1000,
+                    wait_max_ms=self._wait_max[priority] * 1000,
+                )
+                for priority in Priority
+            },
+        )
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Literal, Optional, TypeVar
+import aiohttp
+from pydantic import BaseModel
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+# * Response statuses worth retrying, anything else means the backend answered
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(
+            f"Circuit open for {endpoint}, retrying in {max(retry_in, 0):.1f}s"
+        )
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class RetryPolicy(BaseModel):
+    max_attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 2.0
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter exponential backoff for the given (1-based) attempt"""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+
+class BreakerConfig(BaseModel):
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    half_open_probes: int = 1
+
+
+class EndpointStats(BaseModel):
+    state: BreakerState
+    calls: int
+    successes: int
+    failures: int
+    retries: int
+    short_circuits: int
+    opened: int
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in TRANSIENT_STATUSES
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+def is_client_error(error: BaseException) -> bool:
+    """A 4xx answer, the backend is up and rejected the request itself.
+    Check `is_transient` first, 429 is one too."""
+    return isinstance(error, aiohttp.ClientResponseError) and 400 <= error.status < 500
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probing state"""
+
+    def __init__(
+        self,
+        endpoint: str,
+        config: BreakerConfig,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.endpoint = endpoint
+        self.config = config
+        self._clock = clock
+
+        self.state: BreakerState = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuits = 0
+        self.opened = 0
+
+    def acquire(self):
+        """Raise CircuitOpenError if the call is not allowed through"""
+        if self.state == "open":
+            retry_in = self.opened_at + self.config.reset_timeout - self._clock()
+            if retry_in > 0:
+                self.short_circuits += 1
+                raise CircuitOpenError(self.endpoint, retry_in)
+            self._transition("half_open")
+
+        if self.state == "half_open":
+            if self.probes_in_flight >= self.config.half_open_probes:
+                self.short_circuits += 1
+                raise CircuitOpenError(self.endpoint, 0)
+            self.probes_in_flight += 1
+
+        self.calls += 1
+
+    def release(self):
+        """Give back a call slot without judging the endpoint's health"""
+        if self.state == "half_open":
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+
+    def record_success(self):
+        self.successes += 1
+        self.consecutive_failures = 0
+        if self.state == "half_open":
+            self.probes_in_flight -= 1
+            self._transition("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open":
+            self.probes_in_flight -= 1
+            self._open()
+        elif self.consecutive_failures >= self.config.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.opened += 1
+        self.opened_at = self._clock()
+        self._transition("open")
+
+    def _transition(self, state: BreakerState):
+        if state != self.state:
+            logger.warning(
+                "[resilience] - circuit %s: %s -> %s", self.endpoint, self.state, state
+            )
+        self.state = state
+        if state != "half_open":
+            self.probes_in_flight = 0
+
+    def stats(self) -> EndpointStats:
+        return EndpointStats(
+            state=self.state,
+            calls=self.calls,
+            successes=self.successes,
+            failures=self.failures,
+            retries=self.retries,
+            short_circuits=self.short_circuits,
+            opened=self.opened,
+        )
+
+
+class Resilience:
+    """Retries and per-endpoint circuit breaking shared by all Api calls"""
+
+    def __init__(self, retry_policy: RetryPolicy, breaker_config: BreakerConfig):
+        self.retry_policy = retry_policy
+        self.breaker_config = breaker_config
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, self.breaker_config)
+            self.breakers[endpoint] = breaker
+        return breaker
+
+    async def call(
+        self,
+        endpoint: str,
+        fn: Callable[[], Awaitable[T]],
+        idempotent: bool,
+        deadline: Optional[Deadline] = None,
+    ) -> T:
+        """Run `fn` through the endpoint's breaker, retrying transient failures
+        of idempotent calls with jittered exponential backoff while the deadline allows.
+        """
+        breaker = self.breaker(endpoint)
+        attempt = 1
+        while True:
+            breaker.acquire()
+            try:
+                result = await fn()
+            except Exception as e:
+                if deadline is not None and deadline.expired():
+                    # Our own budget ran out, that says nothing about the backend
+                    breaker.release()
+                    raise
+                if not is_transient(e):
+                    if is_client_error(e):
+                        # The backend answered, so it is healthy as far as the breaker cares
+                        breaker.record_success()
+                    else:
+                        # Likely a bug on our side, that says nothing about the backend
+                        breaker.release()
+                    raise
+                breaker.record_failure()
+                last_error = e
+                if not idempotent or attempt >= self.retry_policy.max_attempts:
+                    raise
+            except BaseException:
+                # Cancelled mid call, release a half-open probe slot without judging
+                breaker.release()
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+            delay = self.retry_policy.backoff(attempt)
+            if deadline is not None and delay >= deadline.remaining():
+                raise last_error
+            breaker.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, EndpointStats]:
+        return {endpoint: b.stats() for endpoint, b in self.breakers.items()}
@@ -0,0 +1,244 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import signal
+from contextlib import asynccontextmanager
+from multiprocessing.process import BaseProcess
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import aiohttp
+from aiohttp import web
+from telegram import Bot
+import codec
+from webhook import SECRET_TOKEN_HEADER
+
+logger = logging.getLogger(__name__)
+
+# * Update fields carrying the chat an update belongs to, in order of preference
+CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "business_message",
+    "edited_business_message",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "message_reaction",
+    "message_reaction_count",
+    "chat_boost",
+    "removed_chat_boost",
+)
+# * Update fields without a chat, sharded by the user instead
+USER_FIELDS = (
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+)
+
+
+def shard_key(data: Dict[str, Any]) -> int:
+    """Chat id of a raw update, or its user id when it is not tied to a chat"""
+    for field in CHAT_FIELDS:
+        body = data.get(field)
+        if body is not None:
+            chat = body.get("chat")
+            if chat is not None:
+                return chat["id"]
+
+    for field in USER_FIELDS:
+        body = data.get(field)
+        if body is not None:
+            message = body.get("message")
+            if message is not None and "chat" in message:
+                return message["chat"]["id"]
+            user = body.get("from") or body.get("user")
+            if user is not None:
+                return user["id"]
+
+    return data.get("update_id", 0)
+
+
+class KeyedLock:
+    """One lock per key, kept only while someone holds or waits for it"""
+
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._users: Dict[int, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: int) -> AsyncIterator[None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class FrontReceiver:
+    """Accepts webhook updates and hands each to the worker owning its chat.
+
+    Worker `i` of `n` owns every chat whose id is `i` modulo `n`, so a chat's
+    state and caches live in one process. The next update of a chat is only
+    forwarded once the worker answered the previous one, so each chat reaches
+    its worker in order while other chats proceed in parallel. A worker answers
+    when the update is handled or after its reply wait, whichever comes first,
+    so a slow update may still be running when the next one arrives: the
+    worker's `UpdateScheduler` keeps the chat's updates in order from there. The
+    worker's response, possibly an inline reply, is relayed back to Telegram.
+    """
+
+    def __init__(self, worker_urls: List[str], secret_token: str):
+        self.worker_urls = worker_urls
+        self.secret_token = secret_token
+        self.chats = KeyedLock()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.forwarded = [0] * len(worker_urls)
+        self.failed = [0] * len(worker_urls)
+
+    def worker_for(self, key: int) -> int:
+        return key % len(self.worker_urls)
+
+    async def receive(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            return web.Response(status=403)
+
+        body = await request.read()
+        try:
+            key = shard_key(codec.loads(body))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return web.Response(status=400)
+
+        worker = self.worker_for(key)
+        async with self.chats.hold(key):
+            try:
+                return await self._forward(worker, body)
+            except aiohttp.ClientError as e:
+                # * Telegram redelivers the update after a failed response
+                self.failed[worker] += 1
+                logger.error("[sharding] - worker %s unavailable: %s", worker, e)
+                return web.Response(status=502)
+
+    async def _forward(self, worker: int, body: bytes) -> web.Response:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        async with self.session.post(
+            self.worker_urls[worker],
+            data=body,
+            headers={
+                SECRET_TOKEN_HEADER: self.secret_token,
+                "Content-Type": "application/json",
+            },
+        ) as response:
+            self.forwarded[worker] += 1
+            return web.Response(
+                status=response.status,
+                body=await response.read(),
+                content_type=response.content_type,
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def run_sharded(
+    run_worker: Callable[[int, int], None],
+    workers: int,
+    listen: str,
+    port: int,
+    worker_base_port: int,
+    webhook_url: Optional[str],
+    bot_token: str,
+    secret_token: str,
+    bot_base_url: str = "https://api.telegram.org/bot",
+    setup_bot: Optional[Callable[[Bot], Awaitable[Any]]] = None,
+):
+    """Run `workers` processes, each serving `run_worker(port, workers)` on a local
+    port, behind a front receiver on `listen:port`. Workers that die are restarted.
+    `setup_bot` runs once here for bot wide setup, e.g. the bot's commands."""
+    context = multiprocessing.get_context("spawn")
+    worker_ports = [worker_base_port + index for index in range(workers)]
+    processes: List[BaseProcess] = []
+
+    def spawn(index: int) -> BaseProcess:
+        process = context.Process(
+            target=run_worker,
+            args=(worker_ports[index], workers),
+            name=f"webhook-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    async def supervise(stop: asyncio.Event):
+        while not stop.is_set():
+            await asyncio.sleep(1)
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not stop.is_set():
+                    logger.error(
+                        "[sharding] - worker %s exited with %s, restarting",
+                        index,
+                        process.exitcode,
+                    )
+                    processes[index] = spawn(index)
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(stop_signal, stop.set)
+
+        processes.extend(spawn(index) for index in range(workers))
+
+        front = FrontReceiver(
+            [f"http://127.0.0.1:{worker_port}/" for worker_port in worker_ports],
+            secret_token,
+        )
+        server = web.Application()
+        server.router.add_post("/", front.receive)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(
+            "Front receiver listening on %s:%s, %s workers", listen, port, workers
+        )
+
+        if webhook_url is not None or setup_bot is not None:
+            # Set once here, workers never touch the webhook or the bot's settings
+            async with Bot(bot_token, base_url=bot_base_url) as bot:
+                if setup_bot is not None:
+                    await setup_bot(bot)
+                if webhook_url is not None:
+                    await bot.set_webhook(url=webhook_url, secret_token=secret_token)
+
+        supervisor = asyncio.create_task(supervise(stop))
+        try:
+            await stop.wait()
+        finally:
+            supervisor.cancel()
+            await runner.cleanup()
+            await front.close()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                await asyncio.to_thread(process.join, 10)
+
+    asyncio.run(serve())
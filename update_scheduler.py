@@ -0,0 +1,163 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, List, Optional, Tuple
+from pydantic import BaseModel
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import metrics
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """Updates sharing a key are handled one after another: the chat, or the user
+    for updates outside of a chat"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class KeyDepth(BaseModel):
+    key: str
+    depth: int
+
+
+class UpdateSchedulerStats(BaseModel):
+    running: int
+    backlog: int
+    keys: int
+    deepest: List[KeyDepth]
+    processed: int
+    backpressure_waits: int
+    backpressure_wait_ms: float
+
+
+class UpdateScheduler(BaseUpdateProcessor):
+    """Update processor running updates of the same chat in order and different
+    chats in parallel, at most `max_concurrent` at a time.
+
+    At most `max_backlog` updates are admitted (queued or running). Beyond that
+    admitting blocks the Application's update fetcher, so its update queue fills
+    up and the webhook or polling stops taking in updates until the backlog
+    drains. To get that, the Application sees a processor of concurrency 1: it
+    hands over updates one at a time, and the hand over returns as soon as the
+    update is admitted.
+    """
+
+    def __init__(self, max_concurrent: int = 64, max_backlog: int = 1_000):
+        super().__init__(max_concurrent_updates=1)
+        self.max_concurrent = max_concurrent
+        self.max_backlog = max_backlog
+        self._running = asyncio.Semaphore(max_concurrent)
+        self._capacity = asyncio.Semaphore(max_backlog)
+        # * Per key: coroutines with the time they were admitted and their update_id
+        self._queues: Dict[
+            Hashable, Deque[Tuple[Awaitable[Any], float, Optional[int]]]
+        ] = {}
+        self._drains: "set[asyncio.Task[None]]" = set()
+        # * Monotonic time each update in flight was received, by update_id
+        self._received: Dict[int, float] = {}
+
+        self.active = 0
+        self.backlog = 0
+        self.processed = 0
+        self.backpressure_waits = 0
+        self.backpressure_wait = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._drains:
+            await asyncio.gather(*self._drains, return_exceptions=True)
+
+    def mark_received(self, update_id: int, at: Optional[float] = None):
+        """Note when an update was received, before it waits for admission"""
+        self._received.setdefault(update_id, time.monotonic() if at is None else at)
+
+    def received_at(self, update: object) -> Optional[float]:
+        """Monotonic time an update in flight was received"""
+        if not isinstance(update, Update):
+            return None
+        return self._received.get(update.update_id)
+
+    async def do_process_update(
+        self, update: object, coroutine: "Awaitable[Any]"
+    ) -> None:
+        update_id = update.update_id if isinstance(update, Update) else None
+        if update_id is not None:
+            self.mark_received(update_id)
+
+        if self._capacity.locked():
+            self.backpressure_waits += 1
+            started = time.monotonic()
+            await self._capacity.acquire()
+            self.backpressure_wait += time.monotonic() - started
+        else:
+            await self._capacity.acquire()
+        self.backlog += 1
+
+        key = update_key(update)
+        if key is None:
+            # * Unordered, runs on its own
+            key = object()
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # The key's drain is already running and picks it up in order
+            queue.append((coroutine, time.monotonic(), update_id))
+            return
+
+        self._queues[key] = deque(((coroutine, time.monotonic(), update_id),))
+        drain = asyncio.create_task(self._drain(key))
+        self._drains.add(drain)
+        drain.add_done_callback(self._drains.discard)
+
+    async def _drain(self, key: Hashable):
+        queue = self._queues[key]
+        while queue:
+            coroutine, admitted, update_id = queue[0]
+            try:
+                async with self._running:
+                    if metrics.enabled:
+                        metrics.UPDATE_QUEUE_LAG.observe(time.monotonic() - admitted)
+                    self.active += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.active -= 1
+            finally:
+                queue.popleft()
+                if update_id is not None:
+                    self._received.pop(update_id, None)
+                self.backlog -= 1
+                self.processed += 1
+                self._capacity.release()
+        del self._queues[key]
+
+    def depths(self) -> List[Tuple[Hashable, int]]:
+        """Queued and running updates per key, deepest first"""
+        return sorted(
+            ((key, len(queue)) for key, queue in self._queues.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+
+    def stats(self, top: int = 10) -> UpdateSchedulerStats:
+        return UpdateSchedulerStats(
+            running=self.active,
+            backlog=self.backlog,
+            keys=len(self._queues),
+            deepest=[
+                KeyDepth(
+                    key=str(key) if isinstance(key, int) else "unordered", depth=depth
+                )
+                for key, depth in self.depths()[:top]
+            ],
+            processed=self.processed,
+            backpressure_waits=self.backpressure_waits,
+            backpressure_wait_ms=self.backpressure_wait * 1000,
+        )
@@ -0,0 +1,163 @@
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from typing import Any, Dict, Optional
+from aiohttp import web
+from telegram import TelegramObject, Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+import codec
+from rate_limiter import PriorityRateLimiter
+from update_scheduler import UpdateScheduler
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# * Handler group running after all others, marks an update as fully handled
+FINISHED_GROUP = 1_000
+
+
+class InlineReplies:
+    """Lets a handler answer its update in the webhook HTTP response.
+
+    Telegram executes one Bot API method passed as the body of the webhook response
+    as if it had been sent separately, saving an outbound request. Its result is
+    never returned though, so only replies whose message is not needed afterwards
+    can go inline, every other call goes out as usual.
+    """
+
+    def __init__(
+        self, rate_limiter: Optional[PriorityRateLimiter] = None, inline: bool = True
+    ):
+        self._slots: Dict[int, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        self._rate_limiter = rate_limiter
+        # * Without inline replies the response is still held until the update is handled
+        self._inline = inline
+        self.inline = 0
+        self.declined = 0
+
+    def open(self, update_id: int) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+        slot = asyncio.get_running_loop().create_future()
+        self._slots[update_id] = slot
+        return slot
+
+    def close(self, update_id: int):
+        self._slots.pop(update_id, None)
+
+    def offer(self, update: Update, method: str, chat_id: int, **params: Any) -> bool:
+        """Send the call inline if the update's response is still open and the chat
+        has budget left right away, returns False when it has to be sent normally"""
+        slot = self._slots.get(update.update_id)
+        if not self._inline or slot is None or slot.done():
+            return False
+
+        if self._rate_limiter is not None and not self._rate_limiter.try_acquire(
+            chat_id
+        ):
+            self.declined += 1
+            return False
+
+        body: Dict[str, Any] = {"method": method, "chat_id": chat_id}
+        for key, value in params.items():
+            if value is None:
+                continue
+            body[key] = value.to_dict() if isinstance(value, TelegramObject) else value
+
+        slot.set_result(body)
+        self.inline += 1
+        return True
+
+    async def finished(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        if not isinstance(update, Update):
+            return
+
+        slot = self._slots.get(update.update_id)
+        if slot is not None and not slot.done():
+            slot.set_result(None)
+
+    def register(self, application: Application):
+        application.bot_data["inline_replies"] = self
+        application.add_handler(
+            TypeHandler(Update, self.finished), group=FINISHED_GROUP
+        )
+
+
+def run_webhook(
+    application: Application,
+    replies: InlineReplies,
+    listen: str,
+    port: int,
+    webhook_url: Optional[str],
+    secret_token: str,
+    reply_wait: float,
+):
+    """Serve the webhook with inline replies, in place of `Application.run_webhook`.
+    Without a `webhook_url` the webhook is not set, e.g. for a worker behind a
+    front receiver."""
+
+    async def receive(request: web.Request) -> web.Response:
+        received = time.monotonic()
+        token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token, secret_token):
+            return web.Response(status=403)
+
+        try:
+            update = Update.de_json(
+                await request.json(loads=codec.loads), application.bot
+            )
+        except ValueError:
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+
+        if isinstance(application.update_processor, UpdateScheduler):
+            # * Handler deadlines count from here, not from when the update is admitted
+            application.update_processor.mark_received(update.update_id, received)
+        slot = replies.open(update.update_id)
+        await application.update_queue.put(update)
+        try:
+            reply = await asyncio.wait_for(asyncio.shield(slot), timeout=reply_wait)
+        except asyncio.TimeoutError:
+            # * Too slow to answer inline, anything it sends later goes out normally
+            reply = None
+        finally:
+            replies.close(update.update_id)
+
+        if reply is None:
+            return web.Response()
+        return web.Response(text=codec.dumps(reply), content_type="application/json")
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(stop_signal, stop.set)
+
+        server = web.Application()
+        server.router.add_post("/", receive)
+        runner = web.AppRunner(server)
+
+        await application.initialize()
+        if application.post_init is not None:
+            await application.post_init(application)
+        if webhook_url is not None:
+            await application.bot.set_webhook(
+                url=webhook_url, secret_token=secret_token
+            )
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info("Webhook server listening on %s:%s", listen, port)
+
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            if application.post_shutdown is not None:
+                await application.post_shutdown(application)
+            await application.shutdown()
+
+    asyncio.run(serve())